@@ -12,20 +12,16 @@ except Exception:
 
 from config import (
     DEMO_MODE, PRIVACY_MODE,
-    MAX_CHARS_PER_CHUNK, CHUNK_OVERLAP_CHARS, TOP_K,
-    MODEL_EMBED, MODEL_QA, MODEL_SUM, MODEL_RERANK,
+    MAX_CHARS_PER_CHUNK, CHUNK_OVERLAP_CHARS, CHUNK_TOKENS, MAX_TOTAL_CHARS, TOP_K,
+    INDEX_TYPE, SPARSE_RETRIEVER,
+    SECTION_SUMMARIES, STREAM_ANSWERS, RESULT_CACHE_MB, WARM_MODELS,
+    BACKEND_EMBED, BACKEND_RERANK, BACKEND_QA, BACKEND_SUM, INGEST_WORKERS,
 )
 
-from modules.ingestion import load_any_to_text
-from modules.embeddings import get_embedder
-from modules.vectorstore import InMemoryVectorStore
-from modules.llm_chat import QAGenerator
-from modules.summarizer import Summarizer
-from modules.topics import extract_topics
-from utils.helpers import chunk_text_streaming
-
-# Optional local cap for very large files
-MAX_TOTAL_CHARS_LOCAL = 400_000
+from modules.engine import Engine, route
+from modules.jobs import JobRunner
+from modules.model_registry import ModelRegistry
+from modules.result_cache import ResultCache
 
 # ---------- Page config & styling ----------
 st.set_page_config(page_title="AI Knowledge Assistant", layout="wide")
@@ -69,39 +65,74 @@ with st.sidebar:
     st.write(f"Demo mode: **{DEMO_MODE}**")
     st.write(f"Privacy mode: **{PRIVACY_MODE}**")
     st.write(f"Top-k passages: {TOP_K}")
-    st.write(f"Chunk size: {MAX_CHARS_PER_CHUNK} chars")
+    st.write(f"Chunk size: {f'{CHUNK_TOKENS} tokens / ' if CHUNK_TOKENS else ''}{MAX_CHARS_PER_CHUNK} chars")
     st.write(f"Overlap: {CHUNK_OVERLAP_CHARS} chars")
-    st.write(f"Max total chars (cap): {MAX_TOTAL_CHARS_LOCAL:,}")
+    st.write(f"Index type: {INDEX_TYPE}")
+    st.write(f"Sparse retriever: {SPARSE_RETRIEVER}")
+    st.write(f"Max total chars (cap): {MAX_TOTAL_CHARS:,}" if MAX_TOTAL_CHARS else "Max total chars (cap): none")
 
     if st.button("Clear Session"):
+        for job in st.session_state.get("jobs", {}).values():
+            job.cancel()
         for k in list(st.session_state.keys()):
             del st.session_state[k]
         st.rerun()
 
-# ---------- Heavy resources (cached once per process) ----------
+# ---------- Shared resources (cached once per process) ----------
 @st.cache_resource(show_spinner=False)
-def _embedder():
-    return get_embedder(MODEL_EMBED)
+def _models():
+    # Each model is built the first time a feature needs it and then shared by all sessions;
+    # WARM_MODELS are preloaded on a background thread so the page renders immediately.
+    registry = ModelRegistry()
+    Engine(models=registry).warm(WARM_MODELS)
+    return registry
 
 @st.cache_resource(show_spinner=False)
-def _qa():
-    return QAGenerator(model_name=MODEL_QA)
+def _results():
+    # Summaries / topics / entity lists keyed by document content, shared by all sessions
+    return ResultCache(max_bytes=RESULT_CACHE_MB * 1024 * 1024)
 
 @st.cache_resource(show_spinner=False)
-def _summarizer():
-    return Summarizer(model_name=MODEL_SUM)
+def _ingest_jobs():
+    # Document ingestion runs here, outside script runs, so tabs stay responsive
+    return JobRunner(max_workers=INGEST_WORKERS)
 
-with st.status("Initializing models...", expanded=False) as status:
-    embedder = _embedder()
-    status.update(label="Embedding model loaded", state="running")
-    qa = _qa()
-    status.update(label="Q&A model loaded", state="running")
-    summarizer = _summarizer()
-    status.update(label="Summarizer ready", state="complete")
+# ---------- Session state ----------
+ss = st.session_state
+ss.setdefault("history", [])         # list[(q, a)]
+ss.setdefault("engine", None)        # per-session corpus on top of the shared models
+ss.setdefault("doc_name", None)      # active document (summaries, topics, entity lists)
+ss.setdefault("jobs", {})            # file name -> IngestJob still being indexed
+if ss.engine is None:
+    ss.engine = Engine(models=_models(), results=_results())
+engine = ss.engine
+
+def _model(kind: str, label: str):
+    """engine.<kind>, with a spinner while it cold-starts."""
+    if engine.loaded(kind) is None:
+        with st.spinner(f"Loading {label} (first use)..."):
+            return getattr(engine, kind)
+    return getattr(engine, kind)
+
+# Model status: backend in use (falls back to "torch" if unavailable or inconsistent) and cold-start time
+MODEL_LABELS = {"embedder": "Embeddings", "qa": "Q&A", "summarizer": "Summarizer", "reranker": "Reranker"}
+REQUESTED_BACKENDS = {"embedder": BACKEND_EMBED, "qa": BACKEND_QA, "summarizer": BACKEND_SUM, "reranker": BACKEND_RERANK}
+with st.sidebar:
+    load_times = {kind: secs for (kind, _), secs in engine.models.load_times().items()}
+    for kind, label in MODEL_LABELS.items():
+        model = engine.loaded(kind)
+        if model is None:
+            st.caption(f"{label}: not loaded yet")
+            continue
+        got, wanted = getattr(model, "backend", "torch"), REQUESTED_BACKENDS[kind]
+        secs = f", loaded in {load_times[kind]:.1f}s" if kind in load_times else ""
+        batcher = getattr(model, "batcher", None)
+        batched = f", avg batch {batcher.stats()['avg_batch']:.1f}" if batcher is not None and batcher.batches else ""
+        st.caption(f"{label}: {got}{f' (requested {wanted})' if got != wanted else ''}{secs}{batched}")
 
 # Warn if using the HF fallback embedder (no sentence-transformers)
 try:
-    if getattr(embedder, "backend", "") == "hf_transformers_fallback":
+    if getattr(engine.loaded("embedder"), "backend", "") == "hf_transformers_fallback":
         st.warning(
             "sentence-transformers is not installed. Using a Transformers fallback for embeddings. "
             "For best performance, install: pip install -U sentence-transformers"
@@ -109,13 +140,56 @@ try:
 except Exception:
     pass
 
-# ---------- Session state ----------
-ss = st.session_state
-ss.setdefault("history", [])         # list[(q, a)]
-ss.setdefault("vectorstore", None)
-ss.setdefault("chunks", [])
-ss.setdefault("doc_name", None)
-ss.setdefault("reranker", None)      # optional singleton
+# ---------- Indexing ----------
+def _submit(name: str, raw: bytes) -> None:
+    """Index one document in the background (doc_id = file name; re-uploads replace it)."""
+    running = ss.jobs.get(name)
+    if running is not None and not running.done:
+        running.cancel()
+    ss.jobs[name] = _ingest_jobs().submit(
+        name, lambda status, progress: engine.prepare_document(name, raw, status=status, progress=progress)
+    )
+
+def _collect_jobs() -> None:
+    """Swap finished documents into the session corpus; script runs are the corpus' only writer."""
+    for name, job in list(ss.jobs.items()):
+        if not job.done:
+            continue
+        del ss.jobs[name]
+        if job.state == "done":
+            n_chunks = job.result.num_chunks
+            engine.attach(job.result)
+            ss.doc_name = name
+            if SECTION_SUMMARIES and not engine.has_section_summaries(name):
+                engine.start_section_summaries(name)
+            st.toast(f"Document ready: {name} ({n_chunks:,} chunks, {job.seconds:.1f}s)")
+        elif job.state == "failed":
+            st.error(f"Indexing {name} failed: {job.error}")
+        else:
+            st.toast(f"Indexing cancelled: {name}")
+
+def _jobs_panel() -> None:
+    """Progress of running ingestion jobs, polled every second while any are active."""
+    for name, job in list(ss.jobs.items()):
+        with st.container(border=True):
+            st.write(f"**{name}**: {job.label}")
+            st.progress(job.progress)
+            if not job.done and st.button("Cancel", key=f"cancel_{name}"):
+                job.cancel()
+    if any(job.done for job in ss.jobs.values()):
+        st.rerun()  # full run, so _collect_jobs() picks the result up
+
+_collect_jobs()
+
+def _cite(i: int) -> str:
+    """Source label for chunk i: document, page and section when known, chunk number."""
+    meta = engine.store.chunk_meta(i)
+    parts = [meta["doc"]]
+    if meta["page"]:
+        parts.append(f"p. {meta['page']}")
+    if meta["section"]:
+        parts.append(meta["section"])
+    return " · ".join(parts + [f"Chunk #{i}"])
 
 # ---------- Document selection / upload ----------
 col_left, col_right = st.columns([3, 2], gap="large")
@@ -129,74 +203,67 @@ with col_left:
         else:
             choice = st.selectbox("Sample files", sample_paths, index=0)
             if st.button("Load Sample"):
-                with st.status("Reading & indexing document...", expanded=True) as status:
-                    with open(choice, "rb") as f:
-                        raw = f.read()
-                    text = load_any_to_text(os.path.basename(choice), raw)
-
-                    status.update(label="Cleaning & chunking (streaming, memory-capped)...", state="running")
-                    chunks = list(
-                        chunk_text_streaming(
-                            text,
-                            max_chars=MAX_CHARS_PER_CHUNK,
-                            overlap=CHUNK_OVERLAP_CHARS,
-                            max_total_chars=MAX_TOTAL_CHARS_LOCAL,
-                            progress=True,
-                        )
-                    )
-
-                    status.update(label="Embedding chunks (batched)...", state="running")
-                    store = InMemoryVectorStore.from_texts_batched(
-                        chunks, embedder, batch_size=64, progress=True
-                    )
-
-                    ss.chunks = chunks
-                    ss.vectorstore = store
-                    ss.history = []
-                    ss.doc_name = os.path.basename(choice)
-
-                    status.update(label="Document ready", state="complete")
-                    st.success(f"Loaded: {ss.doc_name} (chunks: {len(chunks):,})")
+                with open(choice, "rb") as f:
+                    _submit(os.path.basename(choice), f.read())
     else:
         st.subheader("Upload a document (PDF, TXT/MD, DOCX)")
         uploaded = st.file_uploader("Choose a file", type=["pdf", "txt", "md", "docx"])
         if uploaded is not None and st.button("Process Document"):
-            with st.status("Reading & indexing document...", expanded=True) as status:
-                raw = uploaded.read()
-                text = load_any_to_text(getattr(uploaded, "name", "uploaded.bin"), raw)
-
-                status.update(label="Cleaning & chunking (streaming, memory-capped)...", state="running")
-                chunks = list(
-                    chunk_text_streaming(
-                        text,
-                        max_chars=MAX_CHARS_PER_CHUNK,
-                        overlap=CHUNK_OVERLAP_CHARS,
-                        max_total_chars=MAX_TOTAL_CHARS_LOCAL,
-                        progress=True,
-                    )
-                )
-
-                status.update(label="Embedding chunks (batched)...", state="running")
-                store = InMemoryVectorStore.from_texts_batched(
-                    chunks, embedder, batch_size=64, progress=True
-                )
-
-                ss.chunks = chunks
-                ss.vectorstore = store
-                ss.history = []
-                ss.doc_name = getattr(uploaded, "name", "uploaded.bin")
-
-                status.update(label="Document ready", state="complete")
-                st.success(f"Processed: {ss.doc_name} (chunks: {len(chunks):,})")
+            _submit(getattr(uploaded, "name", "uploaded.bin"), uploaded.getvalue())
+    if ss.jobs:
+        # You can keep chatting with loaded documents while these are indexed.
+        st.fragment(run_every=1.0)(_jobs_panel)()
+
+has_docs = engine.store is not None and bool(engine.store.documents)
 
 with col_right:
     st.subheader("Document Status")
-    if ss.vectorstore is None:
+    if not has_docs:
         st.info("No document loaded yet.")
     else:
-        st.write("Document:", ss.doc_name or "Loaded")
-        st.write("Chunks:", f"{len(ss.chunks):,}")
+        docs = engine.store.documents
+        if ss.doc_name not in docs:
+            ss.doc_name = docs[-1]
+        ss.doc_name = st.selectbox(
+            "Active document (summaries, topics, entity lists)", docs, index=docs.index(ss.doc_name)
+        )
+        st.write("Documents:", f"{len(docs):,}")
+        st.write("Chunks:", f"{engine.store.num_chunks:,}")
         st.success("Vector index: ready")
+        info = engine.store.index_info
+        recall = f", recall@10 ≈ {info['recall@10']:.2f}" if "recall@10" in info else ""
+        if "recall@10_rescored" in info:
+            recall += f" ({info['recall@10_rescored']:.2f} re-scored)"
+        size = f", {info['bytes_per_chunk']:,.0f} B/chunk" if "bytes_per_chunk" in info else ""
+        st.caption(f"Index: {info.get('type', 'flat')}{size}{recall}")
+        if SECTION_SUMMARIES:
+            error = engine.section_summaries_error(ss.doc_name)
+            if error:
+                st.warning(f"Section summaries failed: {error}")
+            else:
+                ready = engine.has_section_summaries(ss.doc_name)
+                st.caption("Section summaries: " + ("ready" if ready else "building in the background..."))
+        with st.expander("Manage documents"):
+            for d in docs:
+                c_name, c_btn = st.columns([4, 1])
+                c_name.write(d)
+                if c_btn.button("Remove", key=f"remove_{d}"):
+                    engine.remove_document(d)
+                    st.rerun()
+    qa_model = engine.loaded("qa")
+    if qa_model is not None and qa_model.cache is not None:
+        a_stats = qa_model.cache.stats()
+        st.caption(
+            f"Answer cache: {a_stats['hits']:,} hits / {a_stats['misses']:,} misses "
+            f"({a_stats['hit_rate']:.0%} hit rate, ~{a_stats['saved_s']:.1f}s of generation saved)"
+        )
+    loaded_embedder = engine.loaded("embedder")
+    cache_stats = loaded_embedder.cache_stats() if loaded_embedder is not None else None
+    if cache_stats is not None:
+        st.caption(
+            f"Embedding cache: {cache_stats['hits']:,} hits / {cache_stats['misses']:,} misses "
+            f"({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['bytes'] / 1e6:.1f} MB on disk)"
+        )
 
 st.markdown("---")
 
@@ -205,37 +272,41 @@ tab_chat, tab_sum, tab_topics = st.tabs(["Chat with Document", "Summarize Docume
 
 # ---------------- Chat ----------------
 with tab_chat:
-    st.subheader("Ask questions grounded in the current document")
-    if ss.vectorstore is None:
+    st.subheader("Ask questions grounded in the loaded documents")
+    if not has_docs:
         st.info("Load or process a document first.")
     else:
         q = st.text_input("Your question")
+        all_sections = engine.store.sections()
+        section_filter = (
+            st.multiselect("Limit retrieval to sections (optional)", all_sections) if all_sections else []
+        )
         go = st.button("Answer")
 
         if go and q.strip():
             question = q.strip()
 
-            # Prepare full text for summarizer/extractors (safe due to hierarchical summarizer)
-            full_text = "\n".join(ss.chunks)
-
             # 1) Summary/Explain intent routing (BEFORE retrieval)
-            q_lower = question.lower()
-            wants_summary = any(kw in q_lower for kw in ["summary", "summarize", "executive summary"])
-            wants_explain = any(kw in q_lower for kw in ["explain", "explanation", "why", "how"])
+            kind = route(question)
+            wants_summary = kind == "summary"
+            wants_explain = kind == "explain"
 
             if wants_summary or wants_explain:
-                # User-visible token size warning
-                tok_count = summarizer.estimate_tokens(full_text)
-                if tok_count > summarizer.max_tokens:
-                    st.warning(
-                        f"Long input detected: {tok_count} tokens exceed the model limit "
-                        f"({summarizer.max_tokens}). The document will be processed in windows to avoid errors."
-                    )
+                summarizer = _model("summarizer", "summarizer")
+                # User-visible token size warning (only a full pass reads the whole document)
+                if not engine.has_section_summaries(ss.doc_name):
+                    tok_count = summarizer.estimate_tokens(engine.store.doc_text(ss.doc_name))
+                    if tok_count > summarizer.max_tokens:
+                        st.warning(
+                            f"Long input detected: {tok_count} tokens exceed the model limit "
+                            f"({summarizer.max_tokens}). The document will be processed in windows to avoid errors."
+                        )
                 try:
                     if wants_summary:
-                        result = summarizer.summarize(full_text, max_len=160, min_len=80)
+                        result = engine.summarize(ss.doc_name, max_len=160, min_len=80)
                     else:
-                        result = summarizer.explain(full_text, question=question, max_len=180, min_len=70)
+                        # Only the sections retrieval finds relevant are explained
+                        result, _ = engine.explain(question, ss.doc_name, max_len=180, min_len=70)
                 except Exception as e:
                     st.error(f"Summarization failed: {e}")
                     st.stop()
@@ -249,7 +320,7 @@ with tab_chat:
             from modules.extractors import pick_extractor
             extractor, key = pick_extractor(question)
             if extractor:
-                items = extractor(full_text)
+                items = engine.extract(extractor, ss.doc_name)
 
                 st.write("Answer")
                 if items:
@@ -259,45 +330,52 @@ with tab_chat:
 
                 # Transparent sources
                 with st.expander("Thinking process (sources)"):
-                    hits = ss.vectorstore.query(f"{key} {question}", embedder, k=TOP_K)
-                    for i, score in zip(hits.indices, hits.scores):
-                        snippet = ss.chunks[i][:400].replace("\n", " ")
-                        st.markdown(f"- Chunk #{i} (score={score:.4f})\n\n> {snippet}…")
+                    hits = engine.store.query(f"{key} {question}", engine.embedder, k=TOP_K)
+                    for i, score, doc in zip(hits.indices, hits.scores, hits.doc_ids):
+                        snippet = engine.store.texts[i][:400].replace("\n", " ")
+                        st.markdown(f"- {_cite(i)} (score={score:.4f})\n\n> {snippet}…")
 
                 ss.history.append((question, "; ".join(items) if items else "Not found in the document."))
                 st.stop()
 
             # 3) Default: Hybrid RAG QA with strict, concise output
             with st.status("Retrieving relevant passages...", expanded=False) as status:
-                hits = ss.vectorstore.query(question, embedder, k=TOP_K)
-
-                # Optional reranker: AFTER retrieval, BEFORE answering
-                used_indices = list(hits.indices)  # default order
-                if MODEL_RERANK:
-                    try:
-                        from modules.rerank import Reranker
-                        if ss.reranker is None:
-                            ss.reranker = Reranker(model_name=MODEL_RERANK)
-                        passages = [(i, ss.chunks[i]) for i in used_indices]
-                        ranked = ss.reranker.rerank(question, passages, top_k=len(passages))
-                        used_indices = [int(i) for i, _ in ranked]
-                    except Exception:
-                        pass
-
-                contexts = [ss.chunks[i] for i in used_indices]
-
-                status.update(label="Generating answer...", state="running")
-                answer = qa.answer(query=question, contexts=contexts, history=ss.history)
-                status.update(label="Done", state="complete")
+                # Hybrid retrieval, then the optional reranker (before answering);
+                # a near-duplicate question on the same passages reuses its earlier answer.
+                qa = _model("qa", "Q&A model")
+                used_indices, answer = engine.cached_answer(question, k=TOP_K, sections=section_filter or None)
+
+                contexts = [engine.store.texts[i] for i in used_indices]
+
+                if answer is not None:
+                    status.update(label="Answered from cache", state="complete")
+                elif STREAM_ANSWERS:
+                    status.update(label="Passages ready", state="complete")
+                else:
+                    status.update(label="Generating answer...", state="running")
+                    answer = qa.answer(query=question, contexts=contexts, history=ss.history)
+                    engine.remember_answer(question, answer)
+                    status.update(label="Done", state="complete")
 
-            ss.history.append((question, answer))
             st.write("Answer")
-            st.write(answer)
+            if answer is None:
+                # Tokens appear as they are decoded; the trimmed answer replaces them at the end.
+                box = st.empty()
+                raw = ""
+                for piece in qa.answer_stream(query=question, contexts=contexts, history=ss.history):
+                    raw += piece
+                    box.markdown(raw + " ▌")
+                answer = qa.finalize(raw)
+                box.write(answer)
+                engine.remember_answer(question, answer)
+            else:
+                st.write(answer)
+            ss.history.append((question, answer))
 
             with st.expander("Thinking process (sources)"):
                 for i in used_indices:
-                    snippet = ss.chunks[i][:400].replace("\n", " ")
-                    st.markdown(f"- Chunk #{i}\n\n> {snippet}…")
+                    snippet = engine.store.texts[i][:400].replace("\n", " ")
+                    st.markdown(f"- {_cite(i)}\n\n> {snippet}…")
 
             if ss.history:
                 with st.expander("Conversation so far"):
@@ -307,20 +385,21 @@ with tab_chat:
 # ---------------- Summarize ----------------
 with tab_sum:
     st.subheader("One-click Executive Summary")
-    if ss.vectorstore is None:
+    if not has_docs:
         st.info("Load or process a document first.")
     else:
         if st.button("Generate Summary"):
+            summarizer = _model("summarizer", "summarizer")
             with st.status("Summarizing...", expanded=False) as status:
-                full_text = " ".join(ss.chunks)
-                tok_count = summarizer.estimate_tokens(full_text)
-                if tok_count > summarizer.max_tokens:
-                    st.warning(
-                        f"Long input detected: {tok_count} tokens exceed the model limit "
-                        f"({summarizer.max_tokens}). The document will be processed in windows to avoid errors."
-                    )
+                if not engine.has_section_summaries(ss.doc_name):
+                    tok_count = summarizer.estimate_tokens(engine.store.doc_text(ss.doc_name))
+                    if tok_count > summarizer.max_tokens:
+                        st.warning(
+                            f"Long input detected: {tok_count} tokens exceed the model limit "
+                            f"({summarizer.max_tokens}). The document will be processed in windows to avoid errors."
+                        )
                 try:
-                    summary = summarizer.summarize(full_text, max_len=160, min_len=80)
+                    summary = engine.summarize(ss.doc_name, max_len=160, min_len=80)
                 except Exception as e:
                     st.error(f"Summarization failed: {e}")
                     st.stop()
@@ -330,13 +409,13 @@ with tab_sum:
 # ---------------- Topics ----------------
 with tab_topics:
     st.subheader("Unsupervised topic discovery")
-    if ss.vectorstore is None:
+    if not has_docs:
         st.info("Load or process a document first.")
     else:
         n_topics = st.slider("Number of topics", 2, 8, 4, 1)
         if st.button("Extract Topics"):
             with st.status("Extracting topics...", expanded=False) as status:
-                topics = extract_topics(ss.chunks, n_topics=n_topics)
+                topics = engine.topics(ss.doc_name, n_topics=n_topics)
                 status.update(label="Topics ready", state="complete")
             for i, words in enumerate(topics, 1):
                 st.markdown(f"**Topic {i}:** {', '.join(words)}")
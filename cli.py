@@ -0,0 +1,119 @@
+"""
+Headless Siftline: bulk-ingest documents and answer questions without Streamlit.
+
+  python cli.py ingest data/ --out .cache/corpus
+  python cli.py ask questions.txt --index .cache/corpus [--json]
+  python cli.py ask questions.txt --docs data/          # ingest in-process, then answer
+  python cli.py storage --index .cache/corpus            # bytes/chunk and recall per vector storage
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List
+
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+from modules.engine import Engine
+from modules.vectorstore import InMemoryVectorStore, storage_report
+
+DOC_EXTS = (".pdf", ".txt", ".md", ".docx")
+
+def _find_documents(root: str) -> List[str]:
+    if os.path.isfile(root):
+        return [root]
+    paths = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(DOC_EXTS):
+                paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+def _log(msg: str) -> None:
+    print(msg, file=sys.stderr, flush=True)
+
+def _log_load_times(engine: Engine) -> None:
+    for (kind, name), secs in engine.models.load_times().items():
+        _log(f"Loaded {kind} ({name}) in {secs:.1f}s")
+
+def _ingest(engine: Engine, root: str, summaries: bool = False) -> None:
+    paths = _find_documents(root)
+    if not paths:
+        raise SystemExit(f"No documents found under {root}")
+    for n, path in enumerate(paths, 1):
+        prefix = f"[{n}/{len(paths)}] {os.path.basename(path)}"
+        store = engine.add_file(path, status=lambda label: _log(f"{prefix}: {label}"))
+        _log(f"{prefix}: {store.num_chunks:,} chunks")
+        if summaries:
+            engine.build_section_summaries(store.documents[0], status=lambda label: _log(f"{prefix}: {label}"))
+
+def cmd_ingest(args) -> None:
+    engine = Engine(micro_batching=False)  # single caller: nothing to batch across
+    _ingest(engine, args.docs, summaries=args.summaries)
+    engine.store.save(args.out)
+    _log(f"Saved {len(engine.store.documents)} documents ({engine.store.num_chunks:,} chunks) to {args.out}")
+    _log_load_times(engine)
+
+def cmd_ask(args) -> None:
+    engine = Engine(micro_batching=False)
+    if args.index:
+        engine.store = InMemoryVectorStore.load(args.index, mmap=True)
+    if args.docs:
+        _ingest(engine, args.docs)
+    if engine.store is None:
+        raise SystemExit("Pass --index and/or --docs.")
+
+    with open(args.questions, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+    history = []
+    for q in questions:
+        ans = engine.answer(q, history=history if args.history else None, doc_id=args.doc, sections=args.section)
+        history.append((q, ans.text))
+        if args.json:
+            sources = [dict(engine.store.chunk_meta(i), chunk=i) for i in ans.indices]
+            print(json.dumps({"question": q, "answer": ans.text, "route": ans.route, "sources": sources}))
+        else:
+            print(f"Q: {q}\nA: {ans.text}\n")
+    _log_load_times(engine)
+
+def cmd_storage(args) -> None:
+    store = InMemoryVectorStore.load(args.index, mmap=True)
+    vectors = store.live_vectors()
+    _log(f"{len(vectors):,} vectors of dim {store.dim}")
+    print(f"{'storage':<8} {'bytes/chunk':>12} {'recall@10':>10} {'rescored':>9}")
+    for kind, info in zip(args.kinds, storage_report(vectors, args.kinds, rescore=args.rescore, recall_queries=args.queries)):
+        rescored = f"{info['recall@10_rescored']:.3f}" if "recall@10_rescored" in info else "-"
+        print(f"{kind:<8} {info['bytes_per_chunk']:>12.0f} {info['recall@10']:>10.3f} {rescored:>9}")
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="siftline", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_ing = sub.add_parser("ingest", help="Index a file or directory and save the corpus")
+    p_ing.add_argument("docs", help="Document file or directory (searched recursively)")
+    p_ing.add_argument("--out", required=True, help="Directory to save the corpus to")
+    p_ing.add_argument("--summaries", action="store_true", help="Also precompute section summaries (faster summary/explain)")
+    p_ing.set_defaults(func=cmd_ingest)
+
+    p_ask = sub.add_parser("ask", help="Answer a file of questions (one per line)")
+    p_ask.add_argument("questions", help="Text file with one question per line")
+    p_ask.add_argument("--index", help="Saved corpus directory (from `ingest`)")
+    p_ask.add_argument("--docs", help="Document file or directory to ingest first")
+    p_ask.add_argument("--doc", help="Document for summary/explain/entity questions (default: last added)")
+    p_ask.add_argument("--section", action="append", help="Only retrieve from sections whose title contains this (repeatable)")
+    p_ask.add_argument("--history", action="store_true", help="Feed earlier answers back as conversation history")
+    p_ask.add_argument("--json", action="store_true", help="Emit one JSON object per line")
+    p_ask.set_defaults(func=cmd_ask)
+
+    p_sto = sub.add_parser("storage", help="Compare dense vector storage options on a saved corpus")
+    p_sto.add_argument("--index", required=True, help="Saved corpus directory (from `ingest`)")
+    p_sto.add_argument("--kinds", nargs="+", default=["flat", "fp16", "sq8", "pq", "ivfpq"], help="Index types to compare")
+    p_sto.add_argument("--rescore", type=int, default=4, help="Raw-vector re-scoring factor (0 = off)")
+    p_sto.add_argument("--queries", type=int, default=200, help="Corpus vectors used as recall queries")
+    p_sto.set_defaults(func=cmd_storage)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
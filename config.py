@@ -4,13 +4,105 @@ PRIVACY_MODE = True
 
 # RAG / chunking
 TOP_K = 6
-MAX_CHARS_PER_CHUNK = 900
+MAX_CHARS_PER_CHUNK = 1200   # ceiling; CHUNK_TOKENS is usually the binding limit
 CHUNK_OVERLAP_CHARS = 120
+MAX_TOTAL_CHARS = None      # optional cap on chunked characters per document (None = whole document)
+# Cut chunks at page / heading / paragraph / sentence boundaries and keep page + section
+# metadata per chunk (False = fixed character windows)
+STRUCTURED_CHUNKS = True
+# Token budget per chunk, counted with the embedding model's tokenizer (None = characters
+# only). MAX_CHARS_PER_CHUNK then acts as a ceiling; keep this below the model's max length.
+CHUNK_TOKENS = 200
+
+# PDF text extraction: worker processes (1 = in-process) and pages per worker task
+PDF_WORKERS = 4
+PDF_PAGES_PER_TASK = 8
+# Streaming ingestion: chunks the reader/chunker may run ahead of embedding (bounds memory)
+INGEST_QUEUE_CHUNKS = 256
+# Background ingestion jobs running at once (shared by all sessions; more wait queued)
+INGEST_WORKERS = 2
+
+# Dense index backend: "auto" (by chunk count), "flat", "ivf", "hnsw" or "ivfpq", or
+# exhaustive search over compressed vectors: "fp16" (2 B/dim), "sq8" (1 B/dim), "pq" (~1 B/8 dims)
+INDEX_TYPE = "auto"
+IVF_NPROBE = 16          # IVF lists probed per query (higher = better recall, slower)
+HNSW_EF_SEARCH = 64      # HNSW candidate list size at query time
+# Compressed indexes (fp16 / sq8 / pq / ivfpq): keep exact float32 vectors in a memory-mapped
+# file and re-score this many times the needed candidates with them (0 = off)
+VECTOR_RESCORE = 4
+VECTOR_RAW_DIR = None    # where those files live while indexing (None = system temp dir)
+# Rebuild the index without removed documents once they hold this share of its vectors
+COMPACT_DEAD_FRACTION = 0.25
+
+# Sparse side of hybrid retrieval: "bm25" (inverted index) or "tfidf" (legacy cosine)
+SPARSE_RETRIEVER = "bm25"
 
 # Models (balanced for quality + speed)
 MODEL_EMBED = "sentence-transformers/all-MiniLM-L6-v2"  # or "BAAI/bge-small-en-v1.5"
 MODEL_QA    = "google/flan-t5-base"
 MODEL_SUM   = "sshleifer/distilbart-cnn-12-6"
 
+# Prompt budget for the Q&A model in its own tokens (capped at the model's input limit);
+# history and the highest-ranked passages are packed into it.
+QA_INPUT_TOKENS = 512
+
+# Render Q&A answers token by token as they are generated (False = wait for the full answer)
+STREAM_ANSWERS = True
+
+# Semantic answer cache: reuse an earlier answer when a question retrieves the same chunks and
+# its embedding is at least this cosine-similar to the earlier question (None disables)
+ANSWER_CACHE_THRESHOLD = 0.92
+ANSWER_CACHE_ENTRIES = 512
+
+# Summarizer map stage: windows per model call, and threads running calls in parallel
+SUM_BATCH_SIZE = 4
+SUM_WORKERS = 1
+
+# Summarize each section once in the background after ingestion (stored with the index);
+# executive summaries then reduce the cached partials and "explain" reads only retrieved sections.
+SECTION_SUMMARIES = True
+
+# Memory budget for memoized per-document results (summaries, topics, extracted entities),
+# shared by all sessions in the process and evicted least-recently-used first.
+RESULT_CACHE_MB = 64
+
+# CPU inference backend per model: "torch" (fp32), "int8" (dynamic quantization) or "onnx"
+# (ONNX Runtime, exported once into ONNX_CACHE_DIR). Converted models are checked against
+# fp32 outputs on first use and fall back to "torch" if unavailable or inconsistent.
+BACKEND_EMBED = "torch"
+BACKEND_RERANK = "torch"
+BACKEND_QA = "torch"
+BACKEND_SUM = "torch"
+ONNX_CACHE_DIR = ".cache/onnx"
+
+# Micro-batching: concurrent embedder / reranker / non-streamed Q&A requests from all sessions
+# are queued to one worker per model and run together (up to *_MAX inputs, waiting at most
+# MICRO_BATCH_WAIT_MS for company). Streamed answers (STREAM_ANSWERS) are generated per request.
+MICRO_BATCHING = True
+MICRO_BATCH_MAX = 32
+MICRO_BATCH_QA_MAX = 8
+MICRO_BATCH_WAIT_MS = 5
+
+# Models are loaded on first use; these are preloaded on a background thread at app start
+# (any of "embedder", "qa", "summarizer", "reranker")
+WARM_MODELS = ("embedder", "qa")
+
 # Optional cross-encoder reranker (set to None to disable)
-MODEL_RERANK = "cross-encoder/ms-marco-MiniLM-L-6-v2"
\ No newline at end of file
+MODEL_RERANK = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BATCH_SIZE = 32           # (query, passage) pairs per cross-encoder call
+RERANK_MAX_CANDIDATES = 8        # only the best-fused hits are rescored; the rest keep retrieval order
+RERANK_SKIP_MARGIN = 0.25        # skip reranking when the top fused score leads the next by this much (None = never)
+RERANK_CACHE_ENTRIES = 20_000    # LRU of pair scores keyed by (query hash, chunk)
+
+# Worker processes for embedding large documents at ingestion (1 = in-process). Each worker
+# loads its own model copy and gets cpu_count / EMBED_WORKERS threads; queries stay in-process.
+EMBED_WORKERS = 1               # e.g. 4-8 on a 32-core node
+
+# Optional persistent embedding cache (opt-in; None keeps vectors in memory only).
+# Vectors are keyed by content hash, so re-ingesting a known document skips encoding.
+EMBED_CACHE_DIR = None          # e.g. ".cache/embeddings"
+EMBED_CACHE_MAX_MB = 512
+
+# Optional directory of saved vector stores (opt-in; None rebuilds every session).
+# Stores are keyed by document + chunking settings and reopened memory-mapped.
+INDEX_CACHE_DIR = None          # e.g. ".cache/indexes"
@@ -0,0 +1,174 @@
+"""
+Selectable CPU inference backends for the models in config.py:
+  "torch" - PyTorch fp32 (default)
+  "int8"  - PyTorch with dynamic int8 quantization of the Linear layers
+  "onnx"  - ONNX Runtime; exported once on first use and cached under ONNX_CACHE_DIR
+            (needs `optimum[onnxruntime]`, or sentence-transformers>=3.2 for the embedder)
+A converted model is compared with the fp32 one on a few probe inputs; if it is
+unavailable or disagrees, the fp32 model is used instead. Loaders return the model
+together with the backend actually in use.
+"""
+import json
+import os
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+BACKENDS = ("torch", "int8", "onnx")
+
+PROBES = [
+    "The quarterly report shows revenue grew 12% while operating costs stayed flat.",
+    "Contact the support team at the address listed on the second page.",
+    "Section 3 describes how the model was trained and evaluated.",
+]
+
+def check_backend(backend: str) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; expected one of {BACKENDS}")
+    return backend
+
+def quantize_int8(module):
+    """Copy of a torch module with Linear layers dynamically quantized to int8."""
+    import torch
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+def vectors_agree(ref: np.ndarray, got: np.ndarray, min_cos: float = 0.99) -> bool:
+    """Row-wise cosine similarity of two output matrices is at least min_cos everywhere."""
+    ref = np.asarray(ref, dtype="float32").reshape(len(ref), -1)
+    got = np.asarray(got, dtype="float32").reshape(len(got), -1)
+    if ref.shape != got.shape:
+        return False
+    num = (ref * got).sum(axis=1)
+    den = np.linalg.norm(ref, axis=1) * np.linalg.norm(got, axis=1)
+    cos = np.where(den > 0, num / np.maximum(den, 1e-12), 1.0)
+    return bool(cos.min() >= min_cos)
+
+def scores_agree(ref, got, tol: float = 0.05) -> bool:
+    """Scalar scores match within tol (relative to their spread) and rank the probes the same."""
+    ref = np.asarray(ref, dtype="float32").ravel()
+    got = np.asarray(got, dtype="float32").ravel()
+    if ref.shape != got.shape:
+        return False
+    spread = max(1.0, float(np.abs(ref).max()))
+    return bool(np.abs(ref - got).max() <= tol * spread and (np.argsort(ref) == np.argsort(got)).all())
+
+def texts_agree(ref: List[str], got: List[str], min_match: float = 0.66) -> bool:
+    """At least min_match of the generations are identical (greedy decoding)."""
+    same = sum(1 for a, b in zip(ref, got) if a.strip() == b.strip())
+    return same >= min_match * max(1, len(ref))
+
+# ---------- cache of converted models ----------
+
+def _export_dir(cache_dir: str, model_name: str, kind: str) -> str:
+    return os.path.join(cache_dir, f"{model_name.replace('/', '--')}-{kind}-onnx")
+
+def _read_check(path: str) -> Optional[bool]:
+    try:
+        with open(os.path.join(path, "consistency.json"), encoding="utf-8") as f:
+            return bool(json.load(f)["ok"])
+    except Exception:
+        return None
+
+def _write_check(path: str, ok: bool) -> None:
+    with open(os.path.join(path, "consistency.json"), "w", encoding="utf-8") as f:
+        json.dump({"ok": bool(ok)}, f)
+
+def _load_checked(path: str, load: Callable[[str], object]):
+    """A previously exported model that passed its consistency check, else None."""
+    if not _read_check(path):
+        return None
+    try:
+        return load(path)
+    except Exception:
+        return None
+
+def _export_checked(path: str, export: Callable[[], object], agree: Callable[[object], bool]):
+    """Export once, compare with fp32 and save; None when the check fails (remembered)."""
+    if _read_check(path) is False:
+        return None
+    model = export()
+    os.makedirs(path, exist_ok=True)
+    model.save_pretrained(path)
+    ok = agree(model)
+    _write_check(path, ok)
+    return model if ok else None
+
+# ---------- loaders ----------
+
+def load_sentence_transformer(model_name: str, backend: str = "torch", cache_dir: str = ".cache/onnx") -> Tuple[object, str]:
+    from sentence_transformers import SentenceTransformer
+    path = _export_dir(cache_dir, model_name, "embed")
+    if check_backend(backend) == "onnx":
+        model = _load_checked(path, lambda p: SentenceTransformer(p, backend="onnx"))
+        if model is not None:
+            return model, "onnx"
+    ref = SentenceTransformer(model_name)
+    if backend == "torch":
+        return ref, "torch"
+    expected = ref.encode(PROBES, normalize_embeddings=True)
+    agree = lambda m: vectors_agree(expected, m.encode(PROBES, normalize_embeddings=True))
+    try:
+        if backend == "int8":
+            model = quantize_int8(ref)
+        else:
+            model = _export_checked(path, lambda: SentenceTransformer(model_name, backend="onnx"), agree)
+            return (model, "onnx") if model is not None else (ref, "torch")
+        return (model, "int8") if agree(model) else (ref, "torch")
+    except Exception:
+        return ref, "torch"
+
+def load_cross_encoder(model_name: str, backend: str = "torch", cache_dir: str = ".cache/onnx") -> Tuple[object, str]:
+    from sentence_transformers import CrossEncoder
+    path = _export_dir(cache_dir, model_name, "rerank")
+    if check_backend(backend) == "onnx":
+        model = _load_checked(path, lambda p: CrossEncoder(p, backend="onnx"))
+        if model is not None:
+            return model, "onnx"
+    ref = CrossEncoder(model_name)
+    if backend == "torch":
+        return ref, "torch"
+    pairs = [(PROBES[0], p) for p in PROBES]
+    expected = ref.predict(pairs, show_progress_bar=False)
+    agree = lambda m: scores_agree(expected, m.predict(pairs, show_progress_bar=False))
+    try:
+        if backend == "int8":
+            fp32 = ref.model
+            ref.model = quantize_int8(fp32)
+            if agree(ref):
+                return ref, "int8"
+            ref.model = fp32
+            return ref, "torch"
+        model = _export_checked(path, lambda: CrossEncoder(model_name, backend="onnx"), agree)
+        return (model, "onnx") if model is not None else (ref, "torch")
+    except Exception:
+        return ref, "torch"
+
+def load_seq2seq_pipeline(task: str, model_name: str, backend: str = "torch", cache_dir: str = ".cache/onnx") -> Tuple[object, str]:
+    """transformers pipeline ("summarization" / "text2text-generation") on the chosen backend."""
+    from transformers import pipeline
+    path = _export_dir(cache_dir, model_name, task)
+    if check_backend(backend) == "onnx":
+        def load(p):
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+            return pipeline(task, model=ORTModelForSeq2SeqLM.from_pretrained(p), tokenizer=model_name)
+        pipe = _load_checked(path, load)
+        if pipe is not None:
+            return pipe, "onnx"
+    ref = pipeline(task, model=model_name, tokenizer=model_name)
+    if backend == "torch":
+        return ref, "torch"
+    key = "summary_text" if task == "summarization" else "generated_text"
+    run = lambda p: [o[key] for o in p(PROBES, max_length=40, min_length=1, do_sample=False, truncation=True)]
+    expected = run(ref)
+    wrap = lambda model: pipeline(task, model=model, tokenizer=ref.tokenizer)
+    try:
+        if backend == "int8":
+            pipe = wrap(quantize_int8(ref.model))
+            return (pipe, "int8") if texts_agree(expected, run(pipe)) else (ref, "torch")
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        model = _export_checked(
+            path, lambda: ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True),
+            lambda m: texts_agree(expected, run(wrap(m))),
+        )
+        return (wrap(model), "onnx") if model is not None else (ref, "torch")
+    except Exception:
+        return ref, "torch"
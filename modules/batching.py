@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Sequence
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for one model call into micro-batches.
+    Callers submit lists of inputs from any thread; a single worker thread waits up
+    to `max_wait_ms` after the first pending request for others to arrive, runs
+    `fn` once on the concatenated inputs (up to `max_batch` of them), and hands each
+    caller its slice of the outputs through a Future. Requests larger than
+    `max_batch` run on their own. `fn` must return one output per input, in order.
+    """
+    def __init__(self, fn: Callable[[List], Sequence], max_batch: int = 32, max_wait_ms: float = 5.0, name: str = "batcher"):
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = None
+        self._carry = None  # request that did not fit the previous batch; it opens the next one
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._worker.start()
+
+    def submit(self, inputs: Sequence) -> Future:
+        """Future resolving to the outputs for `inputs`."""
+        fut: Future = Future()
+        if not inputs:
+            fut.set_result([])
+            return fut
+        self._ensure_worker()
+        self._queue.put((list(inputs), fut))
+        return fut
+
+    def __call__(self, inputs: Sequence):
+        """Blocking submit()."""
+        return self.submit(inputs).result()
+
+    def _collect(self) -> List[tuple]:
+        first, self._carry = self._carry, None
+        batch = [first if first is not None else self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                req = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(req[0]) > self.max_batch:
+                self._carry = req
+                break
+            batch.append(req)
+            size += len(req[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            inputs = [x for req, _ in batch for x in req]
+            try:
+                outputs = self.fn(inputs)
+            except BaseException as e:  # every waiting caller sees the failure
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(inputs)
+            pos = 0
+            for req, fut in batch:
+                fut.set_result(outputs[pos: pos + len(req)])
+                pos += len(req)
+
+    def stats(self) -> Dict[str, float]:
+        return {"batches": self.batches, "items": self.items, "avg_batch": (self.items / self.batches) if self.batches else 0.0}
@@ -0,0 +1,170 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+class ChunkArena(Sequence):
+    """
+    One document's cleaned text, stored once, plus an (n, 2) array of chunk spans.
+    Chunks are sliced out on access, so overlapping chunks share storage and the full
+    text is available without re-joining. `buf` is either a str (spans in characters)
+    or a UTF-8 byte buffer such as a memmap (spans in bytes, decoded on access).
+    Optional per-chunk metadata: page number (0 = unknown) and an index into
+    `section_titles` (-1 = no section).
+    """
+    def __init__(
+        self,
+        buf,
+        spans: np.ndarray,
+        pages: Optional[np.ndarray] = None,
+        sections: Optional[np.ndarray] = None,
+        section_titles: Optional[List[str]] = None,
+    ):
+        self._buf = buf
+        self.spans = np.asarray(spans, dtype="int64").reshape(-1, 2)
+        n = len(self.spans)
+        self.pages = np.zeros(n, dtype="int32") if pages is None else np.asarray(pages, dtype="int32")
+        self.sections = np.full(n, -1, dtype="int32") if sections is None else np.asarray(sections, dtype="int32")
+        self.section_titles: List[str] = list(section_titles or [])
+
+    @classmethod
+    def from_spans(cls, spans: Iterable[tuple]) -> "ChunkArena":
+        """
+        Build from iter_chunk_spans() (start, end, chunk) or iter_structured_chunks()
+        (start, end, chunk, page, section) output, keeping each character of the text once.
+        """
+        builder = ArenaBuilder()
+        for span in spans:
+            builder.add(span)
+        return builder.build()
+
+    @classmethod
+    def from_chunks(cls, chunks: Sequence[str], sep: str = "\n") -> "ChunkArena":
+        """Arena over pre-split chunks (no shared overlaps); the text is the chunks joined by `sep`."""
+        spans = np.zeros((len(chunks), 2), dtype="int64")
+        pos = 0
+        for i, c in enumerate(chunks):
+            spans[i] = (pos, pos + len(c))
+            pos += len(c) + len(sep)
+        return cls(sep.join(chunks), spans)
+
+    @property
+    def mapped(self) -> bool:
+        return not isinstance(self._buf, str)
+
+    @property
+    def text(self) -> str:
+        """The whole document text (no copy for in-memory arenas)."""
+        if self.mapped:
+            return bytes(self._buf).decode("utf-8")
+        return self._buf
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        a, b = int(self.spans[i, 0]), int(self.spans[i, 1])
+        if self.mapped:
+            return bytes(self._buf[a:b]).decode("utf-8")
+        return self._buf[a:b]
+
+    def text_range(self, a: int, b: int) -> str:
+        """Text covered by chunks [a, b) (overlaps included once)."""
+        lo, hi = int(self.spans[a, 0]), int(self.spans[b - 1, 1])
+        if self.mapped:
+            return bytes(self._buf[lo:hi]).decode("utf-8")
+        return self._buf[lo:hi]
+
+    def page(self, i: int) -> int:
+        return int(self.pages[i])
+
+    def section(self, i: int) -> str:
+        s = int(self.sections[i])
+        return self.section_titles[s] if s >= 0 else ""
+
+    def meta(self, i: int) -> Dict[str, object]:
+        """
+        Compact metadata of chunk i: page, section title and (start, end) character
+        offsets into `text` (byte spans of mapped arenas are converted).
+        """
+        a, b = int(self.spans[i, 0]), int(self.spans[i, 1])
+        if self.mapped:
+            a = _chars_in(self._buf[:a])
+            b = a + _chars_in(self._buf[int(self.spans[i, 0]):b])
+        return {"page": self.page(i), "section": self.section(i), "start": a, "end": b}
+
+    def section_mask(self, wanted: Sequence[str]) -> np.ndarray:
+        """Chunks whose section title contains any of `wanted` (case-insensitive)."""
+        keys = [w.lower() for w in wanted]
+        hit = np.array([any(k in t.lower() for k in keys) for t in self.section_titles] + [False], dtype=bool)
+        return hit[self.sections]  # -1 (no section) picks the trailing False
+
+    def materialize(self) -> "ChunkArena":
+        """In-memory copy of a mapped arena (character spans); self if already in memory."""
+        if not self.mapped:
+            return self
+        raw = bytes(self._buf)
+        return ChunkArena(raw.decode("utf-8"), _byte_to_char(raw, self.spans), self.pages, self.sections, self.section_titles)
+
+    def encoded(self) -> Tuple[bytes, np.ndarray]:
+        """UTF-8 bytes of the text and the spans as byte offsets (for saving)."""
+        if self.mapped:
+            return bytes(self._buf), self.spans
+        raw = self._buf.encode("utf-8")
+        if len(raw) == len(self._buf):  # ASCII: character and byte offsets coincide
+            return raw, self.spans
+        cp = np.frombuffer(self._buf.encode("utf-32-le"), dtype="<u4")
+        width = 1 + (cp >= 0x80) + (cp >= 0x800) + (cp >= 0x10000)
+        offsets = np.concatenate([[0], np.cumsum(width, dtype="int64")])
+        return raw, offsets[self.spans]
+
+class ArenaBuilder:
+    """Incremental ChunkArena.from_spans(): add() chunker spans as they arrive, then build()."""
+    def __init__(self):
+        self._parts: List[str] = []
+        self._spans: List[Tuple[int, int]] = []
+        self._pages: List[int] = []
+        self._sections: List[int] = []
+        self._title_ids: Dict[str, int] = {}
+        self._covered = 0
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def end_of(self, i: int) -> int:
+        """Text offset where the i-th added chunk ends."""
+        return self._spans[i][1]
+
+    def add(self, span: tuple) -> None:
+        a, b, chunk, *meta = span
+        if b > self._covered:
+            self._parts.append(chunk[self._covered - a:])
+            self._covered = b
+        self._spans.append((a, b))
+        page, section = meta if meta else (0, "")
+        self._pages.append(page)
+        self._sections.append(self._title_ids.setdefault(section, len(self._title_ids)) if section else -1)
+
+    def build(self) -> ChunkArena:
+        return ChunkArena(
+            "".join(self._parts), np.array(self._spans, dtype="int64"),
+            np.array(self._pages), np.array(self._sections), list(self._title_ids),
+        )
+
+def _chars_in(buf) -> int:
+    """Characters encoded by a slice of UTF-8 bytes."""
+    b = np.frombuffer(buf, dtype="uint8")
+    return int(np.count_nonzero((b & 0xC0) != 0x80))
+
+def _byte_to_char(raw: bytes, spans: np.ndarray) -> np.ndarray:
+    """Map byte offsets into `raw` (all on character boundaries) to character offsets."""
+    if not len(spans):
+        return spans
+    b = np.frombuffer(raw, dtype="uint8")
+    is_start = (b & 0xC0) != 0x80  # every byte except UTF-8 continuation bytes
+    char_idx = np.concatenate([[0], np.cumsum(is_start, dtype="int64")])
+    return char_idx[spans]
@@ -1,14 +1,274 @@
-from typing import List
+import copy
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from modules.backends import load_sentence_transformer
+from modules.batching import MicroBatcher
+
+class EmbeddingCache:
+    """
+    Content-addressed, size-bounded on-disk cache of embedding vectors.
+    - Keys are sha1(model name, normalization flag, chunk text), so identical chunks
+      are shared across documents, sessions and restarts.
+    - Vectors are stored as compact float16 blobs in a single SQLite file.
+    - Least-recently-used rows are evicted once the file grows past max_bytes.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024, dtype: str = "float16"):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "embeddings.sqlite")
+        self.max_bytes = int(max_bytes)
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vecs (key BLOB PRIMARY KEY, vec BLOB NOT NULL, used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vecs_used ON vecs(used)")
+        self._conn.commit()
+        self._bytes = int(self._conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM vecs").fetchone()[0])
+
+    @staticmethod
+    def key(model_name: str, normalize: bool, text: str) -> bytes:
+        h = hashlib.sha1()
+        h.update(f"{model_name}\0{int(bool(normalize))}\0".encode("utf-8"))
+        h.update(text.encode("utf-8", errors="surrogatepass"))
+        return h.digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        uniq = list(dict.fromkeys(keys))
+        with self._lock:
+            for s in range(0, len(uniq), 500):  # stay under SQLite's bound-parameter limit
+                part = uniq[s: s + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(f"SELECT key, vec FROM vecs WHERE key IN ({marks})", part).fetchall()
+                for k, blob in rows:
+                    found[bytes(k)] = np.frombuffer(blob, dtype=self.dtype).astype("float32")
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE vecs SET used = ? WHERE key = ?", [(now, k) for k in found])
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, keys: List[bytes], vecs: np.ndarray) -> None:
+        if not keys:
+            return
+        now = time.time()
+        rows = [(k, np.asarray(v, dtype=self.dtype).tobytes(), now) for k, v in zip(keys, vecs)]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO vecs (key, vec, used) VALUES (?, ?, ?)", rows)
+            added = self._conn.total_changes - before
+            self._bytes += added * len(rows[0][1])
+            if self._bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._conn.commit()
+
+    def _evict(self, target_bytes: int) -> None:
+        # Drop least-recently-used rows in batches until we are back under target.
+        while self._bytes > target_bytes:
+            rows = self._conn.execute("SELECT key, LENGTH(vec) FROM vecs ORDER BY used LIMIT 1000").fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+            self._conn.executemany("DELETE FROM vecs WHERE key = ?", [(k,) for k, _ in rows])
+            self._bytes -= sum(n for _, n in rows)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "bytes": self._bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_WORKER_EMBEDDER = None  # set once per worker process by _init_embed_worker
+
+def _init_embed_worker(model_name: str, normalize: bool, backend: str, onnx_cache_dir: str, threads: int) -> None:
+    global _WORKER_EMBEDDER
+    try:
+        import torch
+        torch.set_num_threads(threads)  # split the cores between workers instead of oversubscribing
+    except Exception:
+        pass
+    _WORKER_EMBEDDER = Embedder(model_name, normalize=normalize, backend=backend, onnx_cache_dir=onnx_cache_dir)
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _WORKER_EMBEDDER._encode_now(texts)
 
 class Embedder:
-    def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
+    """
+    Sentence embedder with an optional content-addressed vector cache. The cache only
+    serves ingestion (iter_encode / iter_encode_batches); encode() is for one-off
+    query embeddings, which are never written to disk. With workers > 1, ingestion
+    spreads batches over a pool of processes that each hold their own model copy;
+    vectors come back in input order.
+    """
+    def __init__(
+        self, model_name: str, cache: Optional[EmbeddingCache] = None, normalize: bool = True,
+        backend: str = "torch", onnx_cache_dir: str = ".cache/onnx", workers: int = 1,
+    ):
+        self.model_name = model_name
+        self.normalize = normalize
+        self.cache = cache
+        # backend in use: the requested one, or "torch" if it was unavailable / inconsistent
+        self.model, self.backend = load_sentence_transformer(model_name, backend, onnx_cache_dir)
+        self.batcher: Optional[MicroBatcher] = None
+        self.workers = max(1, int(workers))
+        self._worker_args = (model_name, normalize, backend, onnx_cache_dir)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        # The model's fast tokenizer is not thread-safe (encode() toggles its truncation
+        # state), so forward passes are serialized and token counting, which runs on the
+        # chunker's thread during streamed ingestion, uses a private tokenizer copy.
+        self._encode_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._count_tokenizer = None
+
+    def enable_batching(self, max_batch: int = 32, max_wait_ms: float = 5.0) -> None:
+        """Merge small concurrent encode() calls (e.g. queries from many sessions) into one forward pass."""
+        self.batcher = MicroBatcher(self._encode_now, max_batch, max_wait_ms, name="embedder")
+
+    def _encode_now(self, texts: List[str]) -> np.ndarray:
+        # Normalized by default for cosine/IP compatibility
+        with self._encode_lock:
+            return np.asarray(self.model.encode(texts, normalize_embeddings=self.normalize), dtype="float32")
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if self.batcher is not None and len(texts) < self.batcher.max_batch:
+            return self.batcher(texts)
+        return self._encode_now(texts)  # ingestion-sized batches are already efficient
+
+    def _lookup(self, texts: Sequence[str]) -> Tuple[Optional[List[bytes]], Dict[bytes, np.ndarray], List[int]]:
+        """Cache keys, cached vectors and positions still to encode."""
+        if self.cache is None:
+            return None, {}, list(range(len(texts)))
+        keys = [self.cache.key(self.model_name, self.normalize, t) for t in texts]
+        found = self.cache.get_many(keys)
+        return keys, found, [i for i, k in enumerate(keys) if k not in found]
+
+    def _assemble(self, n: int, keys, found, missing: List[int], fresh: Optional[np.ndarray]) -> np.ndarray:
+        """Merge cached and freshly encoded vectors (in input order) and cache the fresh ones."""
+        if len(missing) == n:
+            out = np.asarray(fresh, dtype="float32")
+        else:
+            dim = len(next(iter(found.values())))
+            out = np.empty((n, dim), dtype="float32")
+            for i, k in enumerate(keys):
+                if k in found:
+                    out[i] = found[k]
+            if missing:
+                out[missing] = fresh
+        if keys is not None and missing:
+            # Round-trip fresh vectors through the storage dtype so results do not
+            # depend on whether a chunk was served from cache or just encoded.
+            out[missing] = out[missing].astype(self.cache.dtype).astype("float32")
+            self.cache.put_many([keys[i] for i in missing], out[missing])
+        return out
 
     def encode(self, texts: List[str]) -> np.ndarray:
-        # Always return normalized embeddings for cosine/IP compatibility
-        return self.model.encode(texts, normalize_embeddings=True)
+        """Embeddings of `texts` (queries), bypassing the vector cache."""
+        return self._encode(texts)
+
+    def _encode_cached(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return self._encode(texts)
+        keys, found, missing = self._lookup(texts)
+        fresh = self._encode([texts[i] for i in missing]) if missing else None
+        return self._assemble(len(texts), keys, found, missing, fresh)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),  # never fork a process holding torch threads
+                    initializer=_init_embed_worker, initargs=(*self._worker_args, threads),
+                )
+            return self._pool
+
+    def iter_encode(self, texts: Sequence[str], batch_size: int = 64) -> Iterator[np.ndarray]:
+        """Cached embeddings of consecutive batches of `texts`, yielded in order (see iter_encode_batches)."""
+        return self.iter_encode_batches(list(texts[a: a + batch_size]) for a in range(0, len(texts), batch_size))
+
+    def iter_encode_batches(self, batches: Iterable[List[str]]) -> Iterator[np.ndarray]:
+        """
+        Cached embeddings of each batch, yielded in order; `batches` may be a lazy stream (e.g.
+        chunks arriving while a PDF is still being read). With workers > 1 (and more
+        than one batch) cache misses are encoded in the process pool, keeping up to two
+        batches per worker in flight.
+        """
+        batches = iter(batches)
+        if self.workers <= 1:
+            for batch in batches:
+                yield self._encode_cached(batch)
+            return
+        first = next(batches, None)
+        second = next(batches, None) if first is not None else None
+        if second is None:
+            if first is not None:
+                yield self._encode_cached(first)
+            return
+
+        pool = self._get_pool()
+        pending: deque = deque()
+
+        def finish() -> np.ndarray:
+            n, keys, found, missing, fut = pending.popleft()
+            return self._assemble(n, keys, found, missing, fut.result() if fut is not None else None)
+
+        for batch in itertools.chain([first, second], batches):
+            keys, found, missing = self._lookup(batch)
+            fut = pool.submit(_encode_in_worker, [batch[i] for i in missing]) if missing else None
+            pending.append((len(batch), keys, found, missing, fut))
+            if len(pending) >= 2 * self.workers:
+                yield finish()
+        while pending:
+            yield finish()
+
+    def close(self) -> None:
+        """Stop the embedding worker processes, if any."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    @property
+    def max_tokens(self) -> int:
+        """Longest input (in tokens) the model embeds without truncation."""
+        return int(getattr(self.model, "max_seq_length", None) or 256)
+
+    def count_tokens(self, text: str) -> int:
+        """Tokens the model sees for `text`, special tokens included (safe to call from any thread)."""
+        with self._count_lock:
+            if self._count_tokenizer is None:
+                self._count_tokenizer = copy.deepcopy(self.model.tokenizer)
+            return len(self._count_tokenizer(text, add_special_tokens=True, truncation=False)["input_ids"])
+
+    def cache_stats(self) -> Optional[Dict[str, float]]:
+        return self.cache.stats() if self.cache is not None else None
 
-def get_embedder(model_name: str) -> Embedder:
-    return Embedder(model_name)
+def get_embedder(
+    model_name: str, cache_dir: Optional[str] = None, cache_max_mb: int = 512,
+    backend: str = "torch", onnx_cache_dir: str = ".cache/onnx", workers: int = 1,
+) -> Embedder:
+    cache = EmbeddingCache(cache_dir, max_bytes=cache_max_mb * 1024 * 1024) if cache_dir else None
+    return Embedder(model_name, cache=cache, backend=backend, onnx_cache_dir=onnx_cache_dir, workers=workers)
@@ -0,0 +1,578 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import config
+from modules.ingestion import count_pieces, is_paginated, iter_any_text
+from modules.model_registry import ModelRegistry
+from modules.result_cache import ResultCache
+from modules.vectorstore import InMemoryVectorStore, ProgressFn
+from utils.helpers import iter_chunk_spans, iter_structured_chunks
+
+StatusFn = Callable[[str], None]  # receives a short human-readable stage label
+
+NOT_FOUND = "Not found in the document."
+SUMMARY_KEYWORDS = ("summary", "summarize", "executive summary")
+EXPLAIN_KEYWORDS = ("explain", "explanation", "why", "how")
+
+def route(question: str) -> str:
+    """Pick the answering path for a question: "summary", "explain", "extract" or "qa"."""
+    from modules.extractors import pick_extractor
+    q = question.lower()
+    if any(kw in q for kw in SUMMARY_KEYWORDS):
+        return "summary"
+    if any(kw in q for kw in EXPLAIN_KEYWORDS):
+        return "explain"
+    if pick_extractor(question)[0] is not None:
+        return "extract"
+    return "qa"
+
+@dataclass
+class Answer:
+    text: str
+    route: str
+    indices: List[int] = field(default_factory=list)   # chunks used as evidence
+
+class _ReadProgress:
+    """
+    Progress of a streamed ingest: text position of the last embedded chunk against the
+    document length, extrapolated from the pieces (pages) read so far.
+    """
+    def __init__(self, n_pieces: int, max_chars: Optional[int] = None):
+        self.n_pieces = max(1, n_pieces)
+        self.max_chars = max_chars
+        self.pieces = 0
+        self.chars = 0
+
+    def count(self, pieces: Iterable[str]) -> Iterator[str]:
+        for piece in pieces:
+            self.pieces += 1
+            self.chars += len(piece) + 1
+            yield piece
+
+    def fraction(self, end: int) -> float:
+        if not self.pieces:
+            return 0.0
+        total = self.chars * max(1.0, self.n_pieces / self.pieces)
+        if self.max_chars:
+            total = min(total, self.max_chars)
+        return min(0.99, end / max(1.0, total))  # 1.0 is reported once the index is built
+
+class Engine:
+    """
+    Headless load → chunk → embed → retrieve → rerank → answer pipeline.
+    Models are created on first use, so ingestion-only jobs never load the
+    QA or summarization models; pass a shared ModelRegistry to build each model
+    once per process (and warm() to preload some in the background). Progress is reported through plain callbacks;
+    nothing here imports Streamlit.
+    """
+
+    def __init__(
+        self,
+        model_embed: str = config.MODEL_EMBED,
+        model_qa: str = config.MODEL_QA,
+        model_sum: str = config.MODEL_SUM,
+        model_rerank: Optional[str] = config.MODEL_RERANK,
+        top_k: int = config.TOP_K,
+        max_chars: int = config.MAX_CHARS_PER_CHUNK,
+        overlap: int = config.CHUNK_OVERLAP_CHARS,
+        max_total_chars: Optional[int] = config.MAX_TOTAL_CHARS,
+        index_type: str = config.INDEX_TYPE,
+        sparse_kind: str = config.SPARSE_RETRIEVER,
+        index_cache_dir: Optional[str] = config.INDEX_CACHE_DIR,
+        structured: bool = config.STRUCTURED_CHUNKS,
+        chunk_tokens: Optional[int] = config.CHUNK_TOKENS,
+        embedder=None,
+        qa=None,
+        summarizer=None,
+        reranker=None,
+        results: Optional[ResultCache] = None,
+        models: Optional[ModelRegistry] = None,
+        micro_batching: bool = config.MICRO_BATCHING,
+    ):
+        self.model_embed = model_embed
+        self.model_qa = model_qa
+        self.model_sum = model_sum
+        self.model_rerank = model_rerank
+        self.top_k = top_k
+        self.max_chars = max_chars
+        self.overlap = overlap
+        self.max_total_chars = max_total_chars
+        self.index_type = index_type
+        self.sparse_kind = sparse_kind
+        self.index_cache_dir = index_cache_dir
+        self.structured = structured
+        self.chunk_tokens = chunk_tokens
+        self.store: Optional[InMemoryVectorStore] = None
+        self._saved: Dict[str, str] = {}          # doc_id -> index cache path it was saved to
+        self._summary_jobs: Dict[str, threading.Thread] = {}
+        self._summary_errors: Dict[str, str] = {}  # doc_id -> why its background build failed
+        # Models come from the registry on first use; pre-built ones may also be injected
+        self.models = models if models is not None else ModelRegistry()
+        self.micro_batching = micro_batching   # applies to models this engine builds
+        self._embedder = embedder
+        self._qa = qa
+        self._summarizer = summarizer
+        self._reranker = reranker
+        self._reranker_failed = False
+        # Derived per-document results; pass one shared instance to share them across engines
+        self.results = results if results is not None else ResultCache(config.RESULT_CACHE_MB * 1024 * 1024)
+        self._doc_hashes: Dict[str, Tuple[int, str]] = {}  # doc_id -> (segment, content sha1)
+        self._pending_answer: Optional[tuple] = None         # see cached_answer / remember_answer
+
+    # ---------- models (lazy) ----------
+
+    def _build_embedder(self):
+        from modules.embeddings import get_embedder
+        embedder = get_embedder(
+            self.model_embed, cache_dir=config.EMBED_CACHE_DIR, cache_max_mb=config.EMBED_CACHE_MAX_MB,
+            backend=config.BACKEND_EMBED, onnx_cache_dir=config.ONNX_CACHE_DIR, workers=config.EMBED_WORKERS,
+        )
+        if self.micro_batching:
+            embedder.enable_batching(config.MICRO_BATCH_MAX, config.MICRO_BATCH_WAIT_MS)
+        return embedder
+
+    def _build_qa(self):
+        from modules.llm_chat import QAGenerator
+        qa = QAGenerator(
+            model_name=self.model_qa, max_input_tokens=config.QA_INPUT_TOKENS,
+            cache_threshold=config.ANSWER_CACHE_THRESHOLD, cache_entries=config.ANSWER_CACHE_ENTRIES,
+            backend=config.BACKEND_QA, onnx_cache_dir=config.ONNX_CACHE_DIR,
+        )
+        if self.micro_batching:
+            qa.enable_batching(config.MICRO_BATCH_QA_MAX, config.MICRO_BATCH_WAIT_MS)
+        return qa
+
+    def _build_summarizer(self):
+        from modules.summarizer import Summarizer
+        return Summarizer(
+            model_name=self.model_sum, batch_size=config.SUM_BATCH_SIZE, workers=config.SUM_WORKERS,
+            backend=config.BACKEND_SUM, onnx_cache_dir=config.ONNX_CACHE_DIR,
+        )
+
+    def _build_reranker(self):
+        from modules.rerank import Reranker
+        reranker = Reranker(
+            model_name=self.model_rerank, batch_size=config.RERANK_BATCH_SIZE,
+            cache_entries=config.RERANK_CACHE_ENTRIES,
+            backend=config.BACKEND_RERANK, onnx_cache_dir=config.ONNX_CACHE_DIR,
+        )
+        if self.micro_batching:
+            reranker.enable_batching(config.MICRO_BATCH_MAX, config.MICRO_BATCH_WAIT_MS)
+        return reranker
+
+    def _model_specs(self) -> Dict[str, Tuple[Optional[str], Callable[[], object]]]:
+        return {
+            "embedder": (self.model_embed, self._build_embedder),
+            "qa": (self.model_qa, self._build_qa),
+            "summarizer": (self.model_sum, self._build_summarizer),
+            "reranker": (self.model_rerank, self._build_reranker),
+        }
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = self.models.get("embedder", self.model_embed, self._build_embedder)
+        return self._embedder
+
+    @property
+    def qa(self):
+        if self._qa is None:
+            self._qa = self.models.get("qa", self.model_qa, self._build_qa)
+        return self._qa
+
+    @property
+    def summarizer(self):
+        if self._summarizer is None:
+            self._summarizer = self.models.get("summarizer", self.model_sum, self._build_summarizer)
+        return self._summarizer
+
+    @property
+    def reranker(self):
+        """Cross-encoder, or None when disabled or unavailable (retrieval order is kept)."""
+        if self._reranker is None and self.model_rerank and not self._reranker_failed:
+            try:
+                self._reranker = self.models.get("reranker", self.model_rerank, self._build_reranker)
+            except Exception:
+                self._reranker_failed = True
+        return self._reranker
+
+    def loaded(self, kind: str):
+        """The "embedder" / "qa" / "summarizer" / "reranker" model if already built, else None."""
+        injected = getattr(self, f"_{kind}")
+        if injected is not None:
+            return injected
+        name = self._model_specs()[kind][0]
+        return self.models.peek(kind, name) if name else None
+
+    def warm(self, kinds) -> Optional[threading.Thread]:
+        """Preload models (e.g. ("embedder", "qa")) on a background thread."""
+        specs = self._model_specs()
+        jobs = [(k, specs[k][0], specs[k][1]) for k in kinds if specs[k][0] and getattr(self, f"_{k}") is None]
+        return self.models.warm(jobs) if jobs else None
+
+    # ---------- ingestion ----------
+
+    def _cache_path(self, name: str, raw: bytes) -> Optional[str]:
+        if not self.index_cache_dir:
+            return None
+        h = hashlib.sha1(
+            f"{name}|{self.model_embed}|{self.max_chars}|{self.overlap}|{self.max_total_chars}|"
+            f"{self.index_type}|{self.sparse_kind}|{self.structured}|{self.chunk_tokens}|{config.VECTOR_RESCORE}|".encode()
+        )
+        h.update(raw)
+        return os.path.join(self.index_cache_dir, h.hexdigest())
+
+    def index_document(
+        self,
+        name: str,
+        raw: bytes,
+        status: Optional[StatusFn] = None,
+        progress: Optional[ProgressFn] = None,
+    ) -> InMemoryVectorStore:
+        """
+        Read, chunk and embed one document into its own store (doc_id = name).
+        Reuses a saved index when index_cache_dir is set.
+        """
+        cache_path = self._cache_path(name, raw)
+        if cache_path:
+            self._saved[name] = cache_path
+        if cache_path and os.path.exists(os.path.join(cache_path, "meta.json")):
+            if status:
+                status("Opening saved index (memory-mapped)...")
+            return InMemoryVectorStore.load(cache_path, mmap=True)
+
+        if status:
+            status("Reading, chunking & embedding (streaming)...")
+        # Extraction and chunking run on a producer thread, a bounded queue ahead of
+        # embedding, so chunks are embedded and indexed while later pages are still read.
+        # The arena keeps the cleaned text once and chunks as (start, end) spans into it.
+        # Progress follows embedding (not chunking, which runs ahead of it).
+        read = _ReadProgress(count_pieces(name, raw), self.max_total_chars)
+        pieces = read.count(iter_any_text(
+            name, raw, pdf_workers=config.PDF_WORKERS, pdf_pages_per_task=config.PDF_PAGES_PER_TASK
+        ))
+        if self.structured:
+            # Sizes are measured in embedding-model tokens when a token budget is set.
+            budget = min(self.chunk_tokens, self.embedder.max_tokens) if self.chunk_tokens else None
+            spans = iter_structured_chunks(
+                pieces, self.max_chars, self.overlap, self.max_total_chars,
+                max_tokens=budget, count_tokens=self.embedder.count_tokens if budget else None,
+                paginated=is_paginated(name),
+            )
+        else:
+            spans = iter_chunk_spans(pieces, self.max_chars, self.overlap, self.max_total_chars)
+
+        def embedded(n: int, end: int) -> None:
+            if status:
+                status(f"Reading, chunking & embedding (streaming)... {n:,} chunks indexed")
+            if progress:
+                progress(read.fraction(end))
+
+        store = InMemoryVectorStore.from_span_stream(
+            spans, self.embedder, batch_size=64, on_batch=embedded, queue_size=config.INGEST_QUEUE_CHUNKS,
+            index_type=self.index_type, nprobe=config.IVF_NPROBE, ef_search=config.HNSW_EF_SEARCH,
+            doc_id=name, sparse_kind=self.sparse_kind, rescore=config.VECTOR_RESCORE, raw_dir=config.VECTOR_RAW_DIR,
+        )
+        if cache_path:
+            store.save(cache_path)
+        if progress:
+            progress(1.0)
+        return store
+
+    def prepare_document(
+        self,
+        name: str,
+        raw: bytes,
+        status: Optional[StatusFn] = None,
+        progress: Optional[ProgressFn] = None,
+    ) -> InMemoryVectorStore:
+        """
+        index_document() plus summarizer tokenization, without touching the corpus, so it
+        can run on a background thread while the session keeps querying; attach() the result.
+        """
+        self._saved.pop(name, None)
+        store = self.index_document(name, raw, status=status, progress=progress)
+        summarizer = self.loaded("summarizer")
+        if summarizer is not None:
+            # Tokenize for the summarizer now, so later summaries / explanations reuse the ids.
+            summarizer.token_ids(store.doc_text(name))
+        return store
+
+    def attach(self, store: InMemoryVectorStore) -> None:
+        """Append a prepared document store to the corpus (documents with the same name are replaced)."""
+        for doc_id in store.documents:
+            self._doc_hashes.pop(doc_id, None)
+        if self.store is None:
+            self.store = store
+        else:
+            self.store.merge(store)  # a replaced document leaves dead rows behind
+            self._compact()
+
+    def remove_document(self, doc_id: str) -> None:
+        """Drop a document from the corpus, compacting the index once enough of it is dead."""
+        store = self._require_store()
+        store.remove_document(doc_id)
+        self._saved.pop(doc_id, None)
+        self._doc_hashes.pop(doc_id, None)
+        self._compact()
+
+    def _compact(self) -> None:
+        # Compaction renumbers segments; carry the known content hashes over to the new numbers.
+        if self.store.compact(config.COMPACT_DEAD_FRACTION):
+            self._doc_hashes = {
+                d: (self.store.docs[d], h) for d, (_, h) in self._doc_hashes.items() if d in self.store.docs
+            }
+
+    def add_document(
+        self,
+        name: str,
+        raw: bytes,
+        status: Optional[StatusFn] = None,
+        progress: Optional[ProgressFn] = None,
+    ) -> InMemoryVectorStore:
+        """Index a document and append it to the corpus (re-adding a name replaces it)."""
+        store = self.prepare_document(name, raw, status=status, progress=progress)
+        self.attach(store)
+        return store
+
+    def add_file(self, path: str, status: Optional[StatusFn] = None, progress: Optional[ProgressFn] = None) -> InMemoryVectorStore:
+        with open(path, "rb") as f:
+            raw = f.read()
+        return self.add_document(os.path.basename(path), raw, status=status, progress=progress)
+
+    # ---------- memoized per-document results ----------
+
+    def doc_hash(self, doc_id: str) -> str:
+        """sha1 of a document's indexed text (computed once per indexed copy)."""
+        store = self._require_store()
+        seg = store.docs[doc_id]
+        known = self._doc_hashes.get(doc_id)
+        if known is None or known[0] != seg:
+            known = (seg, hashlib.sha1(store.doc_text(doc_id).encode("utf-8")).hexdigest())
+            self._doc_hashes[doc_id] = known
+        return known[1]
+
+    def topics(self, doc_id: str, n_topics: int = 4, n_words: int = 8) -> List[List[str]]:
+        from modules.topics import extract_topics
+        key = ResultCache.key(self.doc_hash(doc_id), "topics", n_topics=n_topics, n_words=n_words)
+        return self.results.get_or_compute(
+            key, lambda: extract_topics(self._require_store().doc_texts(doc_id), n_topics=n_topics, n_words=n_words)
+        )
+
+    def extract(self, extractor: Callable[[str], List[str]], doc_id: str) -> List[str]:
+        """Run an entity extractor (see modules.extractors) over a document's full text."""
+        key = ResultCache.key(self.doc_hash(doc_id), f"extract:{extractor.__module__}.{extractor.__name__}")
+        return self.results.get_or_compute(key, lambda: extractor(self._require_store().doc_text(doc_id)))
+
+    # ---------- section summaries ----------
+
+    def has_section_summaries(self, doc_id: str) -> bool:
+        return self.store is not None and doc_id in self.store.summaries
+
+    def section_summaries_error(self, doc_id: str) -> Optional[str]:
+        """Why the last background build for `doc_id` failed (None if it did not)."""
+        return self._summary_errors.get(doc_id)
+
+    def build_section_summaries(self, doc_id: str, status: Optional[StatusFn] = None) -> None:
+        """
+        Summarize each window-sized run of a document's chunks once (breaking at section
+        changes) and keep the partials in the store, and in its saved index when cached.
+        """
+        store = self._require_store()
+        if doc_id not in store.docs or doc_id in store.summaries:
+            return
+        # Pin the version being summarized: a re-upload meanwhile repoints _saved[doc_id]
+        # and compaction renumbers segments, so compare content instead.
+        digest = self.doc_hash(doc_id)
+        cache_path = self._saved.get(doc_id)
+        arena = store.doc_texts(doc_id)
+        ranges = self.summarizer.plan_sections(arena, arena.sections)
+        if status:
+            status(f"Summarizing {len(ranges)} sections...")
+        partials = self.summarizer.summarize_sections([arena.text_range(a, b) for a, b in ranges])
+        if doc_id not in store.docs or self.doc_hash(doc_id) != digest:
+            return  # removed or replaced meanwhile
+        store.set_summaries(doc_id, ranges, partials)
+        if cache_path and os.path.exists(os.path.join(cache_path, "meta.json")):
+            store.save_summaries(cache_path)
+
+    def start_section_summaries(self, doc_id: str) -> threading.Thread:
+        """Run build_section_summaries() on a background thread (one per document)."""
+        job = self._summary_jobs.get(doc_id)
+        if job is None or not job.is_alive():
+            self._summary_errors.pop(doc_id, None)
+            job = threading.Thread(target=self._build_section_summaries_job, args=(doc_id,), daemon=True)
+            self._summary_jobs[doc_id] = job
+            job.start()
+        return job
+
+    def _build_section_summaries_job(self, doc_id: str) -> None:
+        try:
+            self.build_section_summaries(doc_id)
+        except Exception as e:
+            self._summary_errors[doc_id] = str(e) or type(e).__name__
+
+    def summarize(self, doc_id: str, max_len: int = 160, min_len: int = 80) -> str:
+        """
+        Executive summary: a reduce over cached section summaries, else a full pass.
+        Results are memoized per document content, model and lengths.
+        """
+        store = self._require_store()
+
+        def compute() -> str:
+            cached = store.summaries.get(doc_id)
+            if cached:
+                return self.summarizer.summary_from_partials(cached["summaries"], max_len=max_len, min_len=min_len)
+            return self.summarizer.summarize(store.doc_text(doc_id), max_len=max_len, min_len=min_len)
+
+        key = ResultCache.key(self.doc_hash(doc_id), "summary", model=self.model_sum, max_len=max_len, min_len=min_len)
+        return self.results.get_or_compute(key, compute)
+
+    def explain(self, question: str, doc_id: str, max_len: int = 180, min_len: int = 70) -> Tuple[str, List[int]]:
+        """
+        Explain from the sections of `doc_id` that retrieval (limited to that document)
+        finds relevant: their cached summaries when available, else the hit chunks
+        themselves. Falls back to the whole document when nothing in it is retrieved.
+        """
+        store = self._require_store()
+        a, _ = store.doc_range(doc_id)
+        hits = self.retrieve(question, doc_id=doc_id)
+        if not hits:
+            text = self.summarizer.explain(store.doc_text(doc_id), question=question, max_len=max_len, min_len=min_len)
+            return text, []
+        cached = store.summaries.get(doc_id)
+        if cached:
+            local = {i - a for i in hits}
+            passages = [s for (lo, hi), s in zip(cached["ranges"], cached["summaries"]) if any(lo <= i < hi for i in local)]
+        else:
+            passages = [store.texts[i] for i in sorted(hits)]
+        return self.summarizer.explain_passages(passages, question, max_len=max_len, min_len=min_len), hits
+
+    # ---------- retrieval / answering ----------
+
+    def _require_store(self) -> InMemoryVectorStore:
+        assert self.store is not None and self.store.documents, "No documents indexed."
+        return self.store
+
+    def retrieve(
+        self, question: str, k: Optional[int] = None, sections: Optional[List[str]] = None,
+        doc_id: Optional[str] = None,
+    ) -> List[int]:
+        """
+        Hybrid retrieval (optionally limited to chunks under matching section titles and/or
+        to one document), reordered by the cross-encoder when one is available.
+        """
+        store = self._require_store()
+        hits = store.query(question, self.embedder, k=k or self.top_k, sections=sections, doc_id=doc_id)
+        return self._rerank(question, list(hits.indices), hits.scores)
+
+    def _rerank(self, question: str, used: List[int], fused: Optional[List[float]] = None) -> List[int]:
+        """
+        Cross-encoder order for the first RERANK_MAX_CANDIDATES hits (the rest keep
+        retrieval order). Skipped when the fused retrieval scores already single out the
+        top hit by RERANK_SKIP_MARGIN.
+        """
+        reranker = self.reranker
+        if reranker is None or len(used) < 2:
+            return used
+        margin = config.RERANK_SKIP_MARGIN
+        if margin is not None and fused is not None and len(fused) >= 2 and fused[0] - fused[1] >= margin:
+            return used
+        try:
+            ranked = reranker.rerank(
+                question, [(i, self.store.texts[i]) for i in used], top_k=len(used),
+                keys=self._chunk_refs(used), max_candidates=config.RERANK_MAX_CANDIDATES,
+            )
+            used = [int(i) for i, _ in ranked]
+        except Exception:
+            pass
+        return used
+
+    def _chunk_refs(self, indices: List[int]) -> List[Tuple[str, int]]:
+        """Session-independent chunk identities: (document content hash, chunk number in it)."""
+        store = self._require_store()
+        refs = []
+        for i in indices:
+            doc = store.doc_of(i)
+            refs.append((self.doc_hash(doc), int(i) - store.doc_range(doc)[0]))
+        return refs
+
+    def cached_answer(
+        self, question: str, k: Optional[int] = None, sections: Optional[List[str]] = None
+    ) -> Tuple[List[int], Optional[str]]:
+        """
+        retrieve() through the QA model's semantic answer cache. Returns the evidence
+        chunks and, when a near-duplicate question already retrieved exactly the same
+        chunks, its answer (reranking is skipped too). On a miss the answer is None:
+        generate it, then pass it to remember_answer().
+        Conversation history is not part of the key; answers are grounded in the evidence.
+        """
+        cache = self.qa.cache
+        if cache is None:
+            return self.retrieve(question, k=k, sections=sections), None
+        store = self._require_store()
+        q_emb = self.embedder.encode([question])
+        hits = store.query(question, self.embedder, k=k or self.top_k, sections=sections, q_emb=q_emb)
+        candidates = list(hits.indices)
+        if not candidates:
+            return [], None
+        refs = self._chunk_refs(candidates)
+        evidence: Hashable = (self.model_qa, frozenset(refs))
+        found = cache.lookup(evidence, q_emb[0])
+        if found is not None:
+            answer, order = found
+            by_ref = dict(zip(refs, candidates))
+            return [by_ref[r] for r in order], answer
+        started = time.perf_counter()
+        used = self._rerank(question, candidates, hits.scores)
+        self._pending_answer = (question, evidence, q_emb[0], self._chunk_refs(used), started)
+        return used, None
+
+    def remember_answer(self, question: str, answer: str) -> None:
+        """Store the answer generated after a cached_answer() miss for `question`."""
+        pending, self._pending_answer = self._pending_answer, None
+        if pending is None or pending[0] != question or self.qa.cache is None:
+            return
+        _, evidence, vec, order, started = pending
+        self.qa.cache.put(evidence, vec, answer, order, seconds=time.perf_counter() - started)
+
+    def answer(
+        self,
+        question: str,
+        history: Optional[List[Tuple[str, str]]] = None,
+        doc_id: Optional[str] = None,
+        sections: Optional[List[str]] = None,
+    ) -> Answer:
+        """
+        Answer one question against the corpus, using the same routing as the app:
+        summary/explain over `doc_id` (default: the last document), entity extraction,
+        otherwise retrieval-augmented QA (restricted to `sections` when given).
+        """
+        store = self._require_store()
+        history = history or []
+        doc_id = doc_id or store.documents[-1]
+        kind = route(question)
+
+        if kind == "summary":
+            return Answer(self.summarize(doc_id), kind)
+        if kind == "explain":
+            text, used = self.explain(question, doc_id)
+            return Answer(text, kind, used)
+
+        if kind == "extract":
+            from modules.extractors import pick_extractor
+            extractor, key = pick_extractor(question)
+            items = self.extract(extractor, doc_id)
+            hits = store.query(f"{key} {question}", self.embedder, k=self.top_k)
+            return Answer("; ".join(items) if items else NOT_FOUND, kind, list(hits.indices))
+
+        used, text = self.cached_answer(question, sections=sections)
+        if text is None:
+            text = self.qa.answer(query=question, contexts=[store.texts[i] for i in used], history=history)
+            self.remember_answer(question, text)
+        return Answer(text, kind, used)
@@ -1,25 +1,135 @@
-from typing import Union, IO
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Union, IO
 import io
 
-def load_pdf_to_text(fobj_or_path: Union[str, IO[bytes]]) -> str:
-    """Extract text from a PDF. Tries pdfplumber, falls back to pypdf."""
+_PDF_BYTES: Optional[bytes] = None  # set once per worker process by _init_pdf_worker
+
+def _init_pdf_worker(data: bytes) -> None:
+    global _PDF_BYTES
+    _PDF_BYTES = data
+
+def _pdf_page_count(data: bytes) -> int:
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(io.BytesIO(data)).pages)
+    except Exception:
+        pass
     try:
         import pdfplumber
-        with pdfplumber.open(fobj_or_path) as pdf:
-            pages = [p.extract_text() or "" for p in pdf.pages]
-        text = "\n".join(pages).strip()
-        if text:
-            return text
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            return len(pdf.pages)
+    except Exception:
+        return 0
+
+def _extract_pages(data: bytes, start: int, end: int) -> Iterator[str]:
+    """Yield the text of pages [start, end): pdfplumber first, pypdf for any page it fails on."""
+    plumber = reader = None
+    try:
+        import pdfplumber
+        plumber = pdfplumber.open(io.BytesIO(data))
     except Exception:
         pass
+    try:
+        for n in range(start, end):
+            text = ""
+            if plumber is not None:
+                try:
+                    page = plumber.pages[n]
+                    text = page.extract_text() or ""
+                    if hasattr(page, "close"):
+                        page.close()  # drop cached layout objects between pages
+                except Exception:
+                    text = ""
+            if not text.strip():
+                try:
+                    if reader is None:
+                        from pypdf import PdfReader
+                        reader = PdfReader(io.BytesIO(data))
+                    text = reader.pages[n].extract_text() or ""
+                except Exception:
+                    text = ""
+            yield text
+    finally:
+        if plumber is not None:
+            plumber.close()
+
+def _extract_page_range(start: int, end: int) -> List[str]:
+    return list(_extract_pages(_PDF_BYTES, start, end))
+
+def iter_pdf_pages(
+    fobj_or_path: Union[str, bytes, IO[bytes]],
+    workers: int = 1,
+    pages_per_task: int = 8,
+) -> Iterator[str]:
+    """
+    Yield PDF page texts in page order as they become available.
+    With workers > 1, page ranges are extracted across a process pool; each page
+    falls back to pypdf on its own. At most two ranges per worker are in flight, so a
+    slow consumer holds back extraction instead of buffering the whole document.
+    Closing the generator early cancels pending pages.
+    """
+    if isinstance(fobj_or_path, bytes):
+        data = fobj_or_path
+    elif isinstance(fobj_or_path, str):
+        with open(fobj_or_path, "rb") as f:
+            data = f.read()
+    else:
+        data = fobj_or_path.read()
 
+    n_pages = _pdf_page_count(data)
+    pages_per_task = max(1, int(pages_per_task))
+    if workers <= 1 or n_pages <= pages_per_task:
+        yield from _extract_pages(data, 0, n_pages)
+        return
+
+    ranges = iter([(a, min(a + pages_per_task, n_pages)) for a in range(0, n_pages, pages_per_task)])
+    workers = min(workers, -(-n_pages // pages_per_task))
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),  # never fork a process holding model/job threads
+        initializer=_init_pdf_worker, initargs=(data,),
+    )
     try:
-        from pypdf import PdfReader
-        reader = PdfReader(fobj_or_path)
-        pages = [(pg.extract_text() or "") for pg in reader.pages]
-        return "\n".join(pages).strip()
+        futures = deque(pool.submit(_extract_page_range, a, b) for a, b in itertools.islice(ranges, 2 * workers))
+        while futures:
+            fut = futures.popleft()
+            nxt = next(ranges, None)
+            if nxt is not None:
+                futures.append(pool.submit(_extract_page_range, *nxt))
+            yield from fut.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def load_pdf_to_text(fobj_or_path: Union[str, IO[bytes]], workers: int = 1) -> str:
+    """Extract text from a PDF. Tries pdfplumber, falls back to pypdf page by page."""
+    return "\n".join(iter_pdf_pages(fobj_or_path, workers=workers)).strip()
+
+def _decode(raw: bytes) -> str:
+    try:
+        return raw.decode("utf-8", errors="ignore")
     except Exception:
-        return ""
+        return raw.decode("latin-1", errors="ignore")
+
+def iter_any_text(filename: str, raw: bytes, pdf_workers: int = 1, pdf_pages_per_task: int = 8) -> Iterator[str]:
+    """
+    Streaming counterpart of load_any_to_text: PDFs yield one piece per page as
+    pages are extracted; other formats yield their whole text once.
+    """
+    if filename.lower().endswith(".pdf"):
+        yield from iter_pdf_pages(raw, workers=pdf_workers, pages_per_task=pdf_pages_per_task)
+    else:
+        yield load_any_to_text(filename, raw)
+
+def is_paginated(filename: str) -> bool:
+    """Whether iter_any_text() yields real pages (PDFs) rather than one whole text."""
+    return filename.lower().endswith(".pdf")
+
+def count_pieces(filename: str, raw: bytes) -> int:
+    """Number of pieces iter_any_text() yields: pages for PDFs, else 1."""
+    return _pdf_page_count(raw) if is_paginated(filename) else 1
 
 def load_any_to_text(filename: str, raw: bytes) -> str:
     """
@@ -36,10 +146,7 @@ def load_any_to_text(filename: str, raw: bytes) -> str:
         return load_pdf_to_text(bio)
 
     if name.endswith(".txt") or name.endswith(".md"):
-        try:
-            return raw.decode("utf-8", errors="ignore")
-        except Exception:
-            return raw.decode("latin-1", errors="ignore")
+        return _decode(raw)
 
     if name.endswith(".docx"):
         try:
@@ -49,7 +156,4 @@ def load_any_to_text(filename: str, raw: bytes) -> str:
         except Exception:
             return ""
 
-    try:
-        return raw.decode("utf-8", errors="ignore")
-    except Exception:
-        return raw.decode("latin-1", errors="ignore")
+    return _decode(raw)
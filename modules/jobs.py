@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+class JobCancelled(Exception):
+    """Raised inside a job's status/progress callbacks once cancel() was requested."""
+
+class IngestJob:
+    """
+    Handle for one document ingestion running in the background.
+    The worker reports through status()/progress(), which the UI polls via `label`,
+    `progress` and `state` ("queued", "running", "done", "failed", "cancelled").
+    cancel() is cooperative: the next status/progress report raises JobCancelled,
+    which unwinds the pipeline (and stops its extraction/embedding workers).
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "queued"
+        self.label = "Queued..."
+        self.progress = 0.0
+        self.result = None
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._cancel = threading.Event()
+        self._future: Optional[Future] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def cancel(self) -> None:
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():  # never started
+            self.state, self.label = "cancelled", "Cancelled"
+
+    def status(self, label: str) -> None:
+        self._check()
+        self.label = label
+
+    def set_progress(self, frac: float) -> None:
+        self._check()
+        self.progress = max(self.progress, min(1.0, float(frac)))
+
+    def _check(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(self.name)
+
+    def _run(self, fn: Callable) -> None:
+        self.started = time.time()
+        self.state = "running"
+        try:
+            self._check()
+            result = fn(status=self.status, progress=self.set_progress)
+            self._check()
+            self.result = result
+            self.state, self.label, self.progress = "done", "Ready", 1.0
+        except JobCancelled:
+            self.state, self.label = "cancelled", "Cancelled"
+        except Exception as e:
+            self.state, self.label, self.error = "failed", "Failed", str(e)
+        finally:
+            self.finished = time.time()
+
+class JobRunner:
+    """
+    Small shared pool for ingestion jobs: submit() returns an IngestJob right away and
+    runs `fn(status=..., progress=...)` on a worker thread; at most `max_workers` jobs
+    run at once, the rest wait queued.
+    """
+    def __init__(self, max_workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="ingest")
+
+    def submit(self, name: str, fn: Callable) -> IngestJob:
+        job = IngestJob(name)
+        job._future = self._pool.submit(job._run, fn)
+        return job
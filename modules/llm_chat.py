@@ -1,5 +1,9 @@
-from typing import List, Tuple
-from transformers import pipeline
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+import numpy as np
+from modules.backends import load_seq2seq_pipeline
+from modules.batching import MicroBatcher
 
 SYS_PROMPT = (
     "You are a precise assistant. Use ONLY the provided context.\n"
@@ -10,15 +14,106 @@ SYS_PROMPT = (
     "- Otherwise, answer concisely (1–3 sentences)."
 )
 
+class SemanticAnswerCache:
+    """
+    Answers to earlier questions, grouped by the evidence they were generated from
+    (a hashable key, e.g. the set of retrieved chunks). A new question reuses an answer
+    when it retrieved the same evidence and its unit embedding has cosine similarity
+    >= threshold with the earlier question. Evidence keys are evicted least recently
+    used; `stats()` reports hit rate and the generation time saved.
+    """
+    def __init__(self, threshold: float = 0.92, max_entries: int = 512, per_evidence: int = 8):
+        self.threshold = float(threshold)
+        self.max_entries = max(1, int(max_entries))
+        self.per_evidence = max(1, int(per_evidence))
+        self.hits = 0
+        self.misses = 0
+        self.saved_s = 0.0
+        # evidence -> [(unit question vector, answer, payload, seconds it took)]
+        self._entries: "OrderedDict[Hashable, List[tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype="float32").ravel()
+        n = float(np.linalg.norm(v))
+        return v / n if n > 0 else v
+
+    def lookup(self, evidence: Hashable, vec) -> Optional[Tuple[str, object]]:
+        """(answer, payload) of the closest earlier question on this evidence, if close enough."""
+        v = self._unit(vec)
+        with self._lock:
+            group = self._entries.get(evidence)
+            best = None
+            if group:
+                sims = [float(np.dot(v, e[0])) for e in group]
+                j = int(np.argmax(sims))
+                if sims[j] >= self.threshold:
+                    best = group[j]
+                    self._entries.move_to_end(evidence)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_s += best[3]
+            return best[1], best[2]
+
+    def put(self, evidence: Hashable, vec, answer: str, payload=None, seconds: float = 0.0) -> None:
+        with self._lock:
+            group = self._entries.setdefault(evidence, [])
+            self._entries.move_to_end(evidence)
+            group.append((self._unit(vec), answer, payload, float(seconds)))
+            del group[: -self.per_evidence]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": sum(len(g) for g in self._entries.values()), "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0, "saved_s": self.saved_s,
+            }
+
 class QAGenerator:
-    def __init__(self, model_name: str):
-        self.pipe = pipeline("text2text-generation", model=model_name, tokenizer=model_name)
+    """
+    Strict, grounded answerer. Prompts are packed to a token budget measured with the
+    model's own tokenizer: history (newest first, up to a quarter of the budget), then
+    passages in rank order while they fit, so nothing is silently truncated by the model.
+    With `cache_threshold`, `cache` holds answers for reuse on near-duplicate questions
+    (see SemanticAnswerCache); callers decide the evidence key and consult it.
+    """
+    def __init__(
+        self, model_name: str, max_input_tokens: Optional[int] = None,
+        cache_threshold: Optional[float] = None, cache_entries: int = 512,
+        backend: str = "torch", onnx_cache_dir: str = ".cache/onnx",
+    ):
+        self.pipe, self.backend = load_seq2seq_pipeline("text2text-generation", model_name, backend, onnx_cache_dir)
+        self.tokenizer = self.pipe.tokenizer
+        limit = int(getattr(self.tokenizer, "model_max_length", 0) or 0)
+        limit = limit if 0 < limit < 100_000 else 512  # some tokenizers report a huge sentinel
+        self.max_input_tokens = min(max_input_tokens or limit, limit)
+        self.cache = SemanticAnswerCache(cache_threshold, cache_entries) if cache_threshold else None
+        self.batcher: Optional[MicroBatcher] = None
 
-    def _build_prompt(self, query: str, contexts: List[str], history: List[Tuple[str, str]]):
-        hist = ""
-        for q, a in history[-3:]:
-            hist += f"\nQ: {q}\nA: {a}\n"
-        ctx = "\n\n".join(contexts[:4])
+    def enable_batching(self, max_batch: int = 8, max_wait_ms: float = 5.0) -> None:
+        """Generate concurrent answer() calls together (streamed answers still run one by one)."""
+        self.batcher = MicroBatcher(self._generate_now, max_batch, max_wait_ms, name="qa")
+
+    def _generate_now(self, prompts: List[str]) -> List[str]:
+        outs = self.pipe(prompts, max_new_tokens=128, do_sample=False, batch_size=len(prompts))
+        return [(o[0] if isinstance(o, list) else o).get("generated_text", "") for o in outs]
+
+    def _count(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def _clip(self, text: str, tokens: int) -> str:
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"][:max(0, tokens)]
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def _render(self, query: str, ctx: str, hist: str) -> str:
         return (
             f"{SYS_PROMPT}\n"
             f"{'Conversation so far:' if hist else ''}{hist}\n"
@@ -27,14 +122,81 @@ class QAGenerator:
             f"Answer:"
         )
 
+    def _build_prompt(self, query: str, contexts: List[str], history: List[Tuple[str, str]]):
+        # Fixed part (instructions + question + scaffolding), plus the end-of-sequence token.
+        budget = self.max_input_tokens - self._count([self._render(query, "", "\n")])[0] - 1
+
+        turns = [f"\nQ: {q}\nA: {a}\n" for q, a in history[-3:]]
+        kept_turns: List[str] = []
+        hist_budget = budget // 4
+        for turn, n in zip(reversed(turns), reversed(self._count(turns))):
+            if n > hist_budget:
+                break
+            kept_turns.insert(0, turn)
+            hist_budget -= n
+        hist = "".join(kept_turns)
+        budget -= self._count([hist])[0] if hist else 0
+
+        sep = self._count(["\n\n"])[0]
+        packed: List[str] = []
+        for passage, n in zip(contexts, self._count(list(contexts))):
+            if n + (sep if packed else 0) <= budget:
+                packed.append(passage)
+                budget -= n + (sep if len(packed) > 1 else 0)
+        if not packed and contexts:
+            packed = [self._clip(contexts[0], budget)]  # top passage alone is too long
+        return self._render(query, "\n\n".join(packed), hist)
+
     def _trim(self, text: str, max_sentences: int = 3) -> str:
         s = text.strip().split("\n")[0]
         parts = [p.strip() for p in s.split(".") if p.strip()]
         return (". ".join(parts[:max_sentences]) + ("." if parts else "")).strip() or s
 
+    def finalize(self, raw: str) -> str:
+        """Clean a raw generation into the final answer."""
+        out = raw.strip()
+        return self._trim(out, 3) if out else "Not found in the document."
+
     def answer(self, query: str, contexts: List[str], history: List[Tuple[str, str]]):
         if not contexts:
             return "Not found in the document."
         prompt = self._build_prompt(query, contexts, history)
-        out = self.pipe(prompt, max_new_tokens=128, do_sample=False)[0].get("generated_text", "").strip()
-        return self._trim(out, 3) if out else "Not found in the document."
+        out = (self.batcher if self.batcher is not None else self._generate_now)([prompt])[0]
+        return self.finalize(out)
+
+    def answer_stream(self, query: str, contexts: List[str], history: List[Tuple[str, str]]) -> Iterator[str]:
+        """
+        Yield raw answer text as it is decoded (same greedy settings as answer()).
+        Generation runs on a background thread; pass the joined pieces to finalize()
+        for the trimmed answer.
+        """
+        if not contexts:
+            yield "Not found in the document."
+            return
+        from transformers import TextIteratorStreamer  # lazy import
+
+        prompt = self._build_prompt(query, contexts, history)
+        tokenizer, model = self.pipe.tokenizer, self.pipe.model
+        enc = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=self.max_input_tokens)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        failure: List[BaseException] = []
+
+        def run():
+            try:
+                model.generate(
+                    input_ids=enc["input_ids"].to(model.device),
+                    attention_mask=enc["attention_mask"].to(model.device),
+                    max_new_tokens=128, do_sample=False, streamer=streamer,
+                )
+            except BaseException as e:  # surface in the caller instead of leaving the stream open
+                failure.append(e)
+                streamer.end()
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        for piece in streamer:
+            if piece:
+                yield piece
+        worker.join()
+        if failure:
+            raise failure[0]
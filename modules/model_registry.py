@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+class ModelRegistry:
+    """
+    Process-wide set of lazily built models, keyed by (kind, model name).
+    A model is constructed on first request, once, even if several threads (sessions,
+    a warm-up thread) ask for it at the same time; its cold-start time is recorded.
+    """
+    def __init__(self):
+        self._models: Dict[Tuple[str, str], object] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._seconds: Dict[Tuple[str, str], float] = {}
+        self._guard = threading.Lock()
+
+    def get(self, kind: str, name: str, build: Callable[[], object]):
+        key = (kind, name)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            model = self._models.get(key)
+            if model is None:
+                started = time.perf_counter()
+                model = build()  # exceptions propagate; nothing is cached
+                self._seconds[key] = time.perf_counter() - started
+                self._models[key] = model
+        return model
+
+    def peek(self, kind: str, name: str) -> Optional[object]:
+        """The model if it is already built (never triggers a load)."""
+        return self._models.get((kind, name))
+
+    def load_times(self) -> Dict[Tuple[str, str], float]:
+        """Cold-start seconds per (kind, model name), in load order."""
+        return dict(self._seconds)
+
+    def warm(self, jobs: Iterable[Tuple[str, str, Callable[[], object]]]) -> threading.Thread:
+        """Build (kind, name, build) models one after another on a background thread."""
+        jobs = list(jobs)
+
+        def run():
+            for kind, name, build in jobs:
+                try:
+                    self.get(kind, name, build)
+                except Exception:
+                    pass  # the feature that needs it will retry and surface the error
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        return worker
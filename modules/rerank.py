@@ -1,20 +1,76 @@
-from typing import List, Tuple
+import hashlib
+import importlib.util
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Sequence, Tuple
+from modules.batching import MicroBatcher
 
 class Reranker:
     """
     Thin wrapper around a cross-encoder for passage reranking.
     If sentence-transformers or the model is unavailable, instantiation will raise,
     and the app will gracefully fall back to the original order.
+    Pair scores are kept in an LRU keyed by (query hash, passage key), so repeated
+    questions only score passages they have not seen with that query before.
     """
-    def __init__(self, model_name: str):
-        try:
-            from sentence_transformers import CrossEncoder  # lazy import
-        except Exception as e:
-            raise RuntimeError("CrossEncoder unavailable. Install sentence-transformers to enable reranking.") from e
-        self.model = CrossEncoder(model_name)
+    def __init__(
+        self, model_name: str, batch_size: int = 32, cache_entries: int = 4096,
+        backend: str = "torch", onnx_cache_dir: str = ".cache/onnx",
+    ):
+        if importlib.util.find_spec("sentence_transformers") is None:
+            raise RuntimeError("CrossEncoder unavailable. Install sentence-transformers to enable reranking.")
+        from modules.backends import load_cross_encoder
+        self.model, self.backend = load_cross_encoder(model_name, backend, onnx_cache_dir)
+        self.batch_size = max(1, int(batch_size))
+        self._cache: "OrderedDict[Tuple[bytes, Hashable], float]" = OrderedDict()
+        self._cache_entries = max(0, int(cache_entries))
+        self._lock = threading.Lock()
+        self.batcher: Optional[MicroBatcher] = None
 
-    def rerank(self, query: str, passages: List[Tuple[int, str]], top_k: int = 6) -> List[Tuple[int, float]]:
-        pairs = [(query, p) for _, p in passages]
-        scores = self.model.predict(pairs).tolist()
-        ranked = sorted([(passages[i][0], scores[i]) for i in range(len(passages))], key=lambda x: -x[1])
+    def enable_batching(self, max_batch: int = 32, max_wait_ms: float = 5.0) -> None:
+        """Score pairs from concurrent rerank() calls in shared cross-encoder batches."""
+        self.batcher = MicroBatcher(self._predict_now, max(max_batch, self.batch_size), max_wait_ms, name="reranker")
+
+    def _predict_now(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False).tolist()
+
+    def scores(self, query: str, passages: List[Tuple[int, str]], keys: Optional[Sequence[Hashable]] = None) -> List[float]:
+        """Cross-encoder score per passage; `keys` identify passages in the cache (default: their ids)."""
+        qh = hashlib.sha1(query.encode("utf-8")).digest()
+        cache_keys = [(qh, k) for k in (keys if keys is not None else [pid for pid, _ in passages])]
+        out: List[Optional[float]] = [None] * len(passages)
+        with self._lock:
+            for n, key in enumerate(cache_keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    out[n] = self._cache[key]
+        missing = [n for n, s in enumerate(out) if s is None]
+        if missing:
+            pairs = [(query, passages[n][1]) for n in missing]
+            fresh = self.batcher(pairs) if self.batcher is not None else self._predict_now(pairs)
+            with self._lock:
+                for n, s in zip(missing, fresh):
+                    out[n] = float(s)
+                    if self._cache_entries:
+                        self._cache[cache_keys[n]] = float(s)
+                while len(self._cache) > self._cache_entries:
+                    self._cache.popitem(last=False)
+        return out
+
+    def rerank(
+        self,
+        query: str,
+        passages: List[Tuple[int, str]],
+        top_k: int = 6,
+        keys: Optional[Sequence[Hashable]] = None,
+        max_candidates: Optional[int] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Order passages by cross-encoder score. Only the first `max_candidates` (in the
+        given retrieval order) are scored; the rest follow them unscored (-inf).
+        """
+        n = len(passages) if not max_candidates else min(len(passages), max_candidates)
+        scores = self.scores(query, passages[:n], keys[:n] if keys is not None else None)
+        ranked = sorted([(passages[i][0], scores[i]) for i in range(n)], key=lambda x: -x[1])
+        ranked += [(pid, float("-inf")) for pid, _ in passages[n:]]
         return ranked[:top_k]
@@ -0,0 +1,73 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+def _approx_bytes(value) -> int:
+    """Rough in-memory size of a result (strings and nested lists/tuples/dicts of them)."""
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(_approx_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_approx_bytes(k) + _approx_bytes(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+class ResultCache:
+    """
+    Process-wide, memory-bounded LRU of derived per-document results (summaries,
+    topics, extracted entities). Keys are (document hash, operation, parameters), so
+    every session working on the same content shares one entry; the least recently
+    used entries are dropped once the estimated size passes max_bytes.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, Tuple[object, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(doc_hash: str, op: str, **params: Hashable) -> Tuple:
+        return (doc_hash, op, tuple(sorted(params.items())))
+
+    def get(self, key: Tuple) -> Optional[object]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Tuple, value) -> None:
+        size = _approx_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+
+    def get_or_compute(self, key: Tuple, compute: Callable[[], T]) -> T:
+        """Cached value for key, else compute() (outside the lock) and remember it."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries), "bytes": self._bytes,
+                "hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,309 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+N_FEATURES = 2 ** 18
+
+def _csr_rows(data, indices, indptr, a: int, b: int, n_features: int) -> sparse.csr_matrix:
+    """Rows [a, b) of a CSR matrix given as raw arrays, without copying data/indices."""
+    lo, hi = int(indptr[a]), int(indptr[b])
+    return sparse.csr_matrix(
+        (data[lo:hi], indices[lo:hi], np.asarray(indptr[a: b + 1]) - lo),
+        shape=(b - a, n_features),
+        copy=False,
+    )
+
+def top_positive(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest positive scores, best first (partial selection, no full sort)."""
+    cand = np.flatnonzero(scores > 0)
+    if len(cand) > k:
+        cand = cand[np.argpartition(-scores[cand], k - 1)[:k]]
+    return cand[np.argsort(-scores[cand], kind="stable")]
+
+class _HashedTermIndex:
+    """
+    Shared plumbing for sparse retrievers over hashed term counts.
+    There is no fitted vocabulary: every store hashes terms into the same feature
+    space, so per-document blocks can be appended, dropped or moved between stores
+    without re-tokenizing anything.
+    """
+    kind = ""
+
+    def __init__(self, n_features: int = N_FEATURES):
+        self.n_features = n_features
+        self.vectorizer = HashingVectorizer(
+            stop_words="english", alternate_sign=False, norm=None,
+            n_features=n_features, dtype=np.float32,
+        )
+        self.df = np.zeros(n_features, dtype="int64")
+        self.n_rows = 0   # live rows counted in df
+
+    def transform(self, texts: Iterable[str]) -> sparse.csr_matrix:
+        return sparse.csr_matrix(self.vectorizer.transform(texts), dtype=np.float32)
+
+class TfidfIndex(_HashedTermIndex):
+    """
+    Incremental TF-IDF, scored as cosine against every row.
+    - Each document is one CSR block of raw counts.
+    - Document frequencies are running counts. IDF and row norms are recomputed lazily
+      after the corpus changes (O(nnz) arithmetic, no tokenization).
+    Scores match TfidfVectorizer defaults (smooth IDF, L2 rows) up to hash collisions.
+    """
+    kind = "tfidf"
+
+    def __init__(self, n_features: int = N_FEATURES):
+        super().__init__(n_features)
+        self.blocks: List[sparse.csr_matrix] = []
+        self._idf: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+
+    def add_block(self, counts: sparse.csr_matrix) -> int:
+        self.blocks.append(counts)
+        self.df += np.bincount(counts.indices, minlength=self.n_features)
+        self.n_rows += counts.shape[0]
+        self._idf = self._norms = None
+        return len(self.blocks) - 1
+
+    def remove_block(self, i: int) -> None:
+        counts = self.blocks[i]
+        self.df -= np.bincount(counts.indices, minlength=self.n_features)
+        self.n_rows -= counts.shape[0]
+        self.blocks[i] = sparse.csr_matrix(counts.shape, dtype=np.float32)
+        self._idf = self._norms = None
+
+    def block_counts(self, i: int) -> sparse.csr_matrix:
+        return self.blocks[i]
+
+    def _weights(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._idf is None:
+            self._idf = (np.log((1.0 + self.n_rows) / (1.0 + self.df)) + 1.0).astype("float32")
+            idf2 = self._idf ** 2
+            self._norms = np.concatenate(
+                [np.sqrt(b.power(2) @ idf2) for b in self.blocks] or [np.zeros(0, dtype="float32")]
+            )
+        return self._idf, self._norms
+
+    def scores(self, text: str) -> np.ndarray:
+        """Cosine similarity between the query and every row (removed rows score 0)."""
+        idf, norms = self._weights()
+        q = self.transform([text])
+        qw = q.data * idf[q.indices]
+        qn = float(np.linalg.norm(qw))
+        if qn == 0.0 or not self.blocks:
+            return np.zeros(len(norms), dtype="float32")
+        # Row weight is count*idf, so fold one more idf factor into the query vector.
+        vec = np.zeros(self.n_features, dtype="float32")
+        vec[q.indices] = qw / qn * idf[q.indices]
+        raw = np.concatenate([b @ vec for b in self.blocks])
+        return raw / np.maximum(norms, 1e-12)
+
+    def scores_batch(self, texts: List[str]) -> sparse.csr_matrix:
+        """Cosine scores for many queries as one sparse product: (n_queries x n_rows)."""
+        idf, norms = self._weights()
+        q = normalize(self.transform(texts).multiply(idf).tocsr())
+        q = q.multiply(idf).tocsr()
+        if not self.blocks:
+            return sparse.csr_matrix((len(texts), 0), dtype=np.float32)
+        raw = sparse.vstack([b @ q.T for b in self.blocks], format="csr")
+        return (sparse.diags(1.0 / np.maximum(norms, 1e-12)) @ raw).T.tocsr()
+
+    # ---------- persistence ----------
+
+    def save(self, path: str) -> Dict[str, int]:
+        counts = sparse.vstack(self.blocks, format="csr") if self.blocks else sparse.csr_matrix((0, self.n_features))
+        np.save(os.path.join(path, "sparse_data.npy"), counts.data.astype("float32"))
+        np.save(os.path.join(path, "sparse_indices.npy"), counts.indices)
+        np.save(os.path.join(path, "sparse_indptr.npy"), counts.indptr)
+        np.save(os.path.join(path, "sparse_df.npy"), self.df)
+        return {"kind": self.kind, "n_features": self.n_features, "n_rows": self.n_rows}
+
+    @classmethod
+    def load(cls, path: str, meta: Dict[str, int], row_bounds: List[Tuple[int, int]], mmap: bool) -> "TfidfIndex":
+        mode = "r" if mmap else None
+        index = cls(int(meta["n_features"]))
+        data = np.load(os.path.join(path, "sparse_data.npy"), mmap_mode=mode)
+        indices = np.load(os.path.join(path, "sparse_indices.npy"), mmap_mode=mode)
+        indptr = np.load(os.path.join(path, "sparse_indptr.npy"), mmap_mode=mode)
+        index.blocks = [_csr_rows(data, indices, indptr, a, b, index.n_features) for a, b in row_bounds]
+        index.df = np.load(os.path.join(path, "sparse_df.npy"))
+        index.n_rows = int(meta["n_rows"])
+        return index
+
+@dataclass
+class Postings:
+    """Inverted lists for one document block: postings of terms[t] are rows/tf[starts[t]:starts[t+1]]."""
+    terms: np.ndarray    # sorted hashed term ids present in the block
+    starts: np.ndarray   # len(terms) + 1 offsets into rows/tf
+    rows: np.ndarray     # block-local row of each posting
+    tf: np.ndarray       # term frequency of each posting
+    doclen: np.ndarray   # token count per row
+
+    @classmethod
+    def from_counts(cls, counts: sparse.csr_matrix) -> "Postings":
+        coo = counts.tocoo()
+        order = np.lexsort((coo.row, coo.col))
+        cols = coo.col[order]
+        terms, first = np.unique(cols, return_index=True)
+        return cls(
+            terms=terms.astype("int32"),
+            starts=np.append(first, len(cols)).astype("int64"),
+            rows=coo.row[order].astype("int32"),
+            tf=coo.data[order].astype("float32"),
+            doclen=np.asarray(counts.sum(axis=1), dtype="float32").ravel(),
+        )
+
+    @classmethod
+    def empty(cls, n_rows: int) -> "Postings":
+        return cls(
+            terms=np.zeros(0, dtype="int32"), starts=np.zeros(1, dtype="int64"),
+            rows=np.zeros(0, dtype="int32"), tf=np.zeros(0, dtype="float32"),
+            doclen=np.zeros(n_rows, dtype="float32"),
+        )
+
+    def to_counts(self, n_features: int) -> sparse.csr_matrix:
+        cols = np.repeat(self.terms, np.diff(self.starts))
+        return sparse.csr_matrix((self.tf, (self.rows, cols)), shape=(len(self.doclen), n_features))
+
+class BM25Index(_HashedTermIndex):
+    """
+    Okapi BM25 over an inverted index of hashed terms.
+    - Each document block keeps compact posting lists, so a query only touches the
+      postings of its own terms instead of scoring a full matrix.
+    - Document frequencies, lengths and the average length are running totals, so
+      blocks are appended or dropped without rebuilding the rest.
+    """
+    kind = "bm25"
+
+    def __init__(self, n_features: int = N_FEATURES, k1: float = 1.2, b: float = 0.75):
+        super().__init__(n_features)
+        self.k1 = k1
+        self.b = b
+        self.blocks: List[Postings] = []
+        self.total_len = 0.0
+        self._tf_weights: Optional[List[np.ndarray]] = None  # BM25 tf part per posting, for batches
+
+    def add_block(self, counts: sparse.csr_matrix) -> int:
+        return self._add_postings(Postings.from_counts(counts))
+
+    def _add_postings(self, p: Postings) -> int:
+        self.blocks.append(p)
+        self.df[p.terms] += np.diff(p.starts)
+        self.n_rows += len(p.doclen)
+        self.total_len += float(p.doclen.sum())
+        self._tf_weights = None
+        return len(self.blocks) - 1
+
+    def remove_block(self, i: int) -> None:
+        p = self.blocks[i]
+        self.df[p.terms] -= np.diff(p.starts)
+        self.n_rows -= len(p.doclen)
+        self.total_len -= float(p.doclen.sum())
+        self.blocks[i] = Postings.empty(len(p.doclen))
+        self._tf_weights = None
+
+    def block_counts(self, i: int) -> sparse.csr_matrix:
+        return self.blocks[i].to_counts(self.n_features)
+
+    def scores(self, text: str) -> np.ndarray:
+        """BM25 score of every row; only rows in the query terms' postings are touched."""
+        q = self.transform([text])
+        acc = np.zeros(sum(len(p.doclen) for p in self.blocks), dtype="float32")
+        if q.nnz == 0 or self.n_rows == 0:
+            return acc
+        terms, qtf = q.indices, q.data
+        df = self.df[terms]
+        idf = np.log1p((self.n_rows - df + 0.5) / (df + 0.5)).astype("float32")
+        avgdl = max(self.total_len / self.n_rows, 1e-6)
+        k1, b = self.k1, self.b
+
+        offset = 0
+        for p in self.blocks:
+            if len(p.terms):
+                pos = np.minimum(np.searchsorted(p.terms, terms), len(p.terms) - 1)
+                for j in np.flatnonzero(p.terms[pos] == terms):
+                    s, e = p.starts[pos[j]], p.starts[pos[j] + 1]
+                    rows, tf = p.rows[s:e], p.tf[s:e]
+                    denom = tf + k1 * (1.0 - b + b * p.doclen[rows] / avgdl)
+                    acc[offset + rows] += qtf[j] * idf[j] * tf * (k1 + 1.0) / denom
+            offset += len(p.doclen)
+        return acc
+
+    def scores_batch(self, texts: List[str]) -> sparse.csr_matrix:
+        """
+        BM25 scores for many queries as one sparse product: (n_queries x n_rows).
+        Each block's postings double as a CSC matrix over its own terms, weighted by
+        the cached tf/length part of BM25; queries carry qtf * idf.
+        """
+        n_total = sum(len(p.doclen) for p in self.blocks)
+        if self.n_rows == 0:
+            return sparse.csr_matrix((len(texts), n_total), dtype=np.float32)
+        df = self.df
+        idf = np.log1p((self.n_rows - df + 0.5) / (df + 0.5)).astype("float32")
+        q = self.transform(texts).multiply(idf).tocsr()
+        if self._tf_weights is None:
+            avgdl = max(self.total_len / self.n_rows, 1e-6)
+            k1, b = self.k1, self.b
+            self._tf_weights = [
+                p.tf * (k1 + 1.0) / (p.tf + k1 * (1.0 - b + b * p.doclen[p.rows] / avgdl)) for p in self.blocks
+            ]
+        parts = []
+        for p, w in zip(self.blocks, self._tf_weights):
+            if len(p.terms):
+                g = sparse.csc_matrix((w, p.rows, p.starts), shape=(len(p.doclen), len(p.terms)))
+                parts.append(g @ q[:, p.terms].T)
+            else:
+                parts.append(sparse.csr_matrix((len(p.doclen), len(texts)), dtype=np.float32))
+        return sparse.vstack(parts, format="csr").T.tocsr()
+
+    # ---------- persistence ----------
+
+    def save(self, path: str) -> Dict[str, int]:
+        def cat(name, dtype):
+            arrs = [getattr(p, name) for p in self.blocks]
+            return np.concatenate(arrs).astype(dtype) if arrs else np.zeros(0, dtype=dtype)
+        np.save(os.path.join(path, "bm25_terms.npy"), cat("terms", "int32"))
+        np.save(os.path.join(path, "bm25_starts.npy"), cat("starts", "int64"))
+        np.save(os.path.join(path, "bm25_rows.npy"), cat("rows", "int32"))
+        np.save(os.path.join(path, "bm25_tf.npy"), cat("tf", "float32"))
+        np.save(os.path.join(path, "bm25_doclen.npy"), cat("doclen", "float32"))
+        np.save(os.path.join(path, "sparse_df.npy"), self.df)
+        return {
+            "kind": self.kind, "n_features": self.n_features, "n_rows": self.n_rows,
+            "total_len": self.total_len, "k1": self.k1, "b": self.b,
+            "n_terms": [int(len(p.terms)) for p in self.blocks],
+        }
+
+    @classmethod
+    def load(cls, path: str, meta: Dict[str, int], row_bounds: List[Tuple[int, int]], mmap: bool) -> "BM25Index":
+        mode = "r" if mmap else None
+        index = cls(int(meta["n_features"]), k1=float(meta["k1"]), b=float(meta["b"]))
+        arr = {n: np.load(os.path.join(path, f"bm25_{n}.npy"), mmap_mode=mode)
+               for n in ("terms", "starts", "rows", "tf", "doclen")}
+        t0 = p0 = 0
+        for i, ((a, b), nt) in enumerate(zip(row_bounds, meta["n_terms"])):
+            starts = arr["starts"][t0 + i: t0 + i + nt + 1]  # each block stores nt + 1 offsets
+            npost = int(starts[-1]) if nt else 0
+            index.blocks.append(Postings(
+                terms=arr["terms"][t0: t0 + nt],
+                starts=starts,
+                rows=arr["rows"][p0: p0 + npost],
+                tf=arr["tf"][p0: p0 + npost],
+                doclen=arr["doclen"][a:b],
+            ))
+            t0 += nt
+            p0 += npost
+        index.df = np.load(os.path.join(path, "sparse_df.npy"))
+        index.n_rows = int(meta["n_rows"])
+        index.total_len = float(meta["total_len"])
+        return index
+
+SPARSE_INDEXES = {"tfidf": TfidfIndex, "bm25": BM25Index}
+
+def make_sparse_index(kind: str) -> _HashedTermIndex:
+    if kind not in SPARSE_INDEXES:
+        raise ValueError(f"Unknown sparse retriever {kind!r}; expected one of {tuple(SPARSE_INDEXES)}.")
+    return SPARSE_INDEXES[kind]()
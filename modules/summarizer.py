@@ -1,56 +1,168 @@
 from __future__ import annotations
-from typing import List
-from transformers import pipeline
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+import numpy as np
+from modules.backends import load_seq2seq_pipeline
 
 class Summarizer:
     """
     Token-safe, hierarchical summarizer for arbitrarily long documents.
-    - Splits input into token windows within the model's max length.
-    - Summarizes each window.
-    - Re-summarizes the partial summaries into a final executive summary.
+    - Splits input into token windows within the model's max length (no window cap).
+    - Map: summarizes windows in batches, optionally across a small worker pool.
+    - Reduce: packs partial summaries into window-sized groups and re-summarizes,
+      level by level, until a single executive summary remains.
     - Same mechanism powers a concise "explain" mode.
+    Document token ids are cached by content hash (see token_ids), so estimating,
+    summarizing and explaining the same document tokenize it once; map-stage windows
+    are fed to the model as token ids, never decoded back to text.
     """
 
-    def __init__(self, model_name: str):
-        self.pipe = pipeline("summarization", model=model_name, tokenizer=model_name)
+    def __init__(
+        self, model_name: str, batch_size: int = 4, workers: int = 1, token_cache_docs: int = 8,
+        backend: str = "torch", onnx_cache_dir: str = ".cache/onnx",
+    ):
+        self.pipe, self.backend = load_seq2seq_pipeline("summarization", model_name, backend, onnx_cache_dir)
         self.tokenizer = self.pipe.tokenizer
         self.model = self.pipe.model
         self.max_input_tokens = int(getattr(self.model.config, "max_position_embeddings", 1024))
         self.window_tokens = max(256, self.max_input_tokens - 64)
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers))
+        self._token_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._token_cache_docs = max(1, int(token_cache_docs))
+        self._token_lock = threading.Lock()
+        self._ids_lock = threading.Lock()
+        self._ids_tokenizer = None
 
     # ---------- utilities ----------
 
+    def _encode(self, texts: List[str], add_special_tokens: bool = False) -> List[List[int]]:
+        """
+        Token ids through a private tokenizer copy behind a lock: section summaries run on
+        a background thread, and a fast tokenizer must not be used by two threads at once.
+        """
+        with self._ids_lock:
+            if self._ids_tokenizer is None:
+                self._ids_tokenizer = copy.deepcopy(self.tokenizer)
+            return self._ids_tokenizer(list(texts), add_special_tokens=add_special_tokens, truncation=False)["input_ids"]
+
+    def token_ids(self, text: str) -> np.ndarray:
+        """Token ids of `text` (no special tokens), memoized per document content."""
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._token_lock:
+            ids = self._token_cache.get(key)
+            if ids is not None:
+                self._token_cache.move_to_end(key)
+                return ids
+        ids = np.asarray(self._encode([text])[0], dtype="int32")
+        with self._token_lock:
+            self._token_cache[key] = ids
+            while len(self._token_cache) > self._token_cache_docs:
+                self._token_cache.popitem(last=False)
+        return ids
+
     def estimate_tokens(self, text: str) -> int:
         """Return total token count for given text (no truncation)."""
         if not text:
             return 0
-        return len(self.tokenizer.encode(text, truncation=False))
+        return len(self.token_ids(text)) + self.tokenizer.num_special_tokens_to_add()
 
     @property
     def max_tokens(self) -> int:
         """Public accessor for the model's max input positions."""
         return self.max_input_tokens
 
-    def _split_into_token_windows(self, text: str, overlap_tokens: int = 50, max_windows: int = 8) -> List[str]:
+    def _split_into_token_windows(
+        self, text: str, overlap_tokens: int = 50, max_windows: Optional[int] = None, reserve: int = 0
+    ) -> List[np.ndarray]:
+        """Overlapping windows of cached token ids; `reserve` tokens are left free for a prompt head."""
         if not text:
             return []
-        input_ids = self.tokenizer.encode(text, truncation=False)
-        if len(input_ids) <= self.window_tokens:
-            return [text]
+        input_ids = self.token_ids(text)
+        size = max(16, self.window_tokens - reserve)
+        if len(input_ids) <= size:
+            return [input_ids]
 
-        step = max(1, self.window_tokens - overlap_tokens)
-        windows: List[str] = []
+        step = max(1, size - overlap_tokens)
+        windows: List[np.ndarray] = []
         i = 0
-        while i < len(input_ids) and len(windows) < max_windows:
-            chunk_ids = input_ids[i : i + self.window_tokens]
-            chunk_text = self.tokenizer.decode(chunk_ids, skip_special_tokens=True)
-            windows.append(chunk_text)
+        while i < len(input_ids) and (max_windows is None or len(windows) < max_windows):
+            windows.append(input_ids[i : i + size])
             i += step
         return windows
 
-    def _summarize_chunk(self, text: str, max_len: int, min_len: int) -> str:
-        out = self.pipe(text, max_length=max_len, min_length=min_len, do_sample=False)[0]["summary_text"].strip()
-        return out
+    def _summarize_ids_batch(self, windows: List[Sequence[int]], max_len: int, min_len: int) -> List[str]:
+        """Generate straight from token-id windows (same decoding settings as the pipeline)."""
+        import torch  # lazy; transformers already depends on it
+
+        rows = [self.tokenizer.build_inputs_with_special_tokens([int(t) for t in w]) for w in windows]
+        width = max(len(r) for r in rows)
+        pad = self.tokenizer.pad_token_id or 0
+        input_ids = torch.full((len(rows), width), pad, dtype=torch.long)
+        attention = torch.zeros((len(rows), width), dtype=torch.long)
+        for i, r in enumerate(rows):
+            input_ids[i, : len(r)] = torch.tensor(r, dtype=torch.long)
+            attention[i, : len(r)] = 1
+        with torch.no_grad():
+            out = self.model.generate(
+                input_ids=input_ids.to(self.model.device), attention_mask=attention.to(self.model.device),
+                max_length=max_len, min_length=min_len, do_sample=False,
+            )
+        return [t.strip() for t in self.tokenizer.batch_decode(out, skip_special_tokens=True)]
+
+    def _summarize_batch(self, texts: List[str], max_len: int, min_len: int) -> List[str]:
+        outs = self.pipe(
+            texts, max_length=max_len, min_length=min_len, do_sample=False,
+            truncation=True, batch_size=self.batch_size,
+        )
+        return [o["summary_text"].strip() for o in outs]
+
+    def _summarize_many(self, texts: list, max_len: int, min_len: int, batch_fn: Optional[Callable] = None) -> List[str]:
+        """
+        Map step: batched model calls, spread over `workers` threads when enabled.
+        Inputs are texts (pipeline) or token-id windows with batch_fn=_summarize_ids_batch.
+        """
+        batch_fn = batch_fn or self._summarize_batch
+        if not texts:
+            return []
+        groups = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.workers == 1 or len(groups) == 1:
+            return [s for g in groups for s in batch_fn(g, max_len, min_len)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(lambda g: batch_fn(g, max_len, min_len), groups)
+        return [s for group in results for s in group]
+
+    def _pack(self, partials: List[str], budget: int) -> List[str]:
+        """Greedily join consecutive partial summaries into groups of at most `budget` tokens."""
+        groups: List[str] = []
+        cur: List[str] = []
+        used = 0
+        for p in partials:
+            n = len(self._encode([p])[0]) + 1
+            if cur and used + n > budget:
+                groups.append(" ".join(cur))
+                cur, used = [], 0
+            cur.append(p)
+            used += n
+        if cur:
+            groups.append(" ".join(cur))
+        return groups
+
+    def _reduce(self, partials: List[str], head: str, max_len: int, min_len: int) -> str:
+        """Tree reduction over partial summaries; every level fits each group in one window."""
+        head_tokens = len(self._encode([head], add_special_tokens=True)[0]) if head else 0  # not cached: heads are tiny
+        budget = max(64, self.window_tokens - head_tokens)
+        while len(partials) > 1:
+            groups = self._pack(partials, budget)
+            if len(groups) == len(partials):
+                # Each partial fills a window on its own: merge pairwise (truncation keeps it safe).
+                groups = [" ".join(partials[i : i + 2]) for i in range(0, len(partials), 2)]
+            partials = self._summarize_many([head + g for g in groups], max_len=max_len, min_len=min_len)
+        return partials[0]
 
     # ---------- public API ----------
 
@@ -58,27 +170,69 @@ class Summarizer:
         if not text:
             return "**Executive Summary**\n\n"
 
-        windows = self._split_into_token_windows(text, overlap_tokens=50, max_windows=8)
-        partials = [self._summarize_chunk(w, max_len=max_len, min_len=min_len) for w in windows]
+        windows = self._split_into_token_windows(text, overlap_tokens=50)
+        partials = self._summarize_many(windows, max_len=max_len, min_len=min_len, batch_fn=self._summarize_ids_batch)
+        return self.summary_from_partials(partials, max_len=max_len, min_len=min_len)
 
+    def summary_from_partials(self, partials: List[str], max_len: int = 160, min_len: int = 80) -> str:
+        """Executive summary from precomputed section/window summaries (reduce stage only)."""
+        if not partials:
+            return "**Executive Summary**\n\n"
         if len(partials) == 1:
             return f"**Executive Summary**\n\n{partials[0]}"
 
-        combined = " ".join(partials)
-        final = self._summarize_chunk(combined, max_len=max_len, min_len=max(1, min_len // 2))
+        final = self._reduce(list(partials), "", max_len=max_len, min_len=max(1, min_len // 2))
         return f"**Executive Summary**\n\n{final}"
 
-    def explain(self, text: str, question: str, max_len: int = 180, min_len: int = 70) -> str:
-        if not text:
+    def plan_sections(self, chunks: Sequence[str], section_ids: Optional[Sequence[int]] = None) -> List[Tuple[int, int]]:
+        """
+        Group consecutive chunks into [start, end) ranges of at most one model window,
+        closing a group early where the chunk's section changes once it is half full.
+        """
+        if not len(chunks):
+            return []
+        counts = [len(ids) for ids in self._encode(list(chunks))]
+        ranges: List[Tuple[int, int]] = []
+        start, used = 0, 0
+        for i, n in enumerate(counts):
+            new_section = section_ids is not None and i > 0 and section_ids[i] != section_ids[i - 1]
+            if i > start and (used + n > self.window_tokens or (new_section and used >= self.window_tokens // 2)):
+                ranges.append((start, i))
+                start, used = i, 0
+            used += n
+        ranges.append((start, len(counts)))
+        return ranges
+
+    def summarize_sections(self, texts: List[str], max_len: int = 160, min_len: int = 80) -> List[str]:
+        """Map stage over window-sized section texts (one partial summary per section)."""
+        return self._summarize_many(list(texts), max_len=max_len, min_len=min_len)
+
+    def explain_passages(self, passages: List[str], question: str, max_len: int = 180, min_len: int = 70) -> str:
+        """Explain from selected passages only (e.g. retrieved sections), packed into windows."""
+        if not passages:
             return "**Explanation**\n\n"
-
-        windows = self._split_into_token_windows(text, overlap_tokens=50, max_windows=8)
         prompt_head = f"{question}\n\n"
-        partials = [self._summarize_chunk(prompt_head + w, max_len=max_len, min_len=min_len) for w in windows]
+        budget = max(64, self.window_tokens - len(self._encode([prompt_head], add_special_tokens=True)[0]))
+        groups = self._pack(list(passages), budget)
+        partials = self._summarize_many([prompt_head + g for g in groups], max_len=max_len, min_len=min_len)
+        return self._explanation(partials, prompt_head, max_len, min_len)
 
+    def _explanation(self, partials: List[str], prompt_head: str, max_len: int, min_len: int) -> str:
         if len(partials) == 1:
             return f"**Explanation**\n\n{partials[0]}"
 
-        combined = " ".join(partials)
-        final = self._summarize_chunk(prompt_head + combined, max_len=max_len, min_len=max(1, min_len // 2))
+        final = self._reduce(partials, prompt_head, max_len=max_len, min_len=max(1, min_len // 2))
         return f"**Explanation**\n\n{final}"
+
+    def explain(self, text: str, question: str, max_len: int = 180, min_len: int = 70) -> str:
+        if not text:
+            return "**Explanation**\n\n"
+
+        prompt_head = f"{question}\n\n"
+        head_ids = self._encode([prompt_head])[0]
+        windows = self._split_into_token_windows(text, overlap_tokens=50, reserve=len(head_ids))
+        partials = self._summarize_many(
+            [np.concatenate([head_ids, w]) for w in windows], max_len=max_len, min_len=min_len,
+            batch_fn=self._summarize_ids_batch,
+        )
+        return self._explanation(partials, prompt_head, max_len, min_len)
@@ -1,72 +1,668 @@
-from dataclasses import dataclass
-from typing import List
+import bisect
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import weakref
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import numpy as np
 import faiss
-import streamlit as st
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+
+from modules.chunk_arena import ArenaBuilder, ChunkArena
+from modules.sparse_index import SPARSE_INDEXES, make_sparse_index, top_positive
+from utils.helpers import iter_prefetched
+
+STORE_FORMAT_VERSION = 6
+
+# Dense index backends. "auto" picks one from the corpus size (see choose_index_type).
+# "fp16", "sq8" and "pq" are exhaustive like "flat" but store compressed codes.
+INDEX_TYPES = ("flat", "fp16", "sq8", "pq", "ivf", "hnsw", "ivfpq")
+COMPRESSED_TYPES = ("fp16", "sq8", "pq", "ivfpq")  # may keep raw vectors for exact re-scoring
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
 
 @dataclass
 class QueryHits:
     indices: List[int]
     scores: List[float]
+    doc_ids: List[str] = field(default_factory=list)
 
 def _normalize(arr: np.ndarray) -> np.ndarray:
     arr = arr.astype("float32")
     rng = float(arr.max() - arr.min())
     return (arr - arr.min()) / (rng + 1e-6)
 
+def _normalize_rows(arr: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Row-wise _normalize() over the entries where mask is True."""
+    arr = arr.astype("float32")
+    lo = np.where(mask, arr, np.inf).min(axis=1, keepdims=True)
+    hi = np.where(mask, arr, -np.inf).max(axis=1, keepdims=True)
+    lo = np.where(np.isfinite(lo), lo, 0.0)
+    return (arr - lo) / (np.maximum(hi - lo, 0.0) + 1e-6)
+
+def choose_index_type(n: int) -> str:
+    """Exact search is cheap up to ~20k chunks; beyond that use IVF, and compress past 1M."""
+    if n < 20_000:
+        return "flat"
+    if n < 1_000_000:
+        return "ivf"
+    return "ivfpq"
+
+def _pq_shape(dim: int, n: int) -> Tuple[int, int]:
+    """(sub-quantizers, bits per code): ~8 dims per byte, fewer centroids for tiny corpora."""
+    m = next(d for d in range(max(1, dim // 8), 0, -1) if dim % d == 0)
+    return m, int(min(8, max(1, np.log2(max(2, n)))))
+
+def _make_index(kind: str, dim: int, n: int):
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind in ("fp16", "sq8"):
+        qtype = faiss.ScalarQuantizer.QT_fp16 if kind == "fp16" else faiss.ScalarQuantizer.QT_8bit
+        return faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_INNER_PRODUCT)
+    if kind == "pq":
+        return faiss.IndexPQ(dim, *_pq_shape(dim, n), faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 80
+        return index
+    # IVF variants: ~4*sqrt(n) lists, keeping >= 39 training points per centroid.
+    nlist = int(max(1, min(4 * np.sqrt(n), n // 39)))
+    quantizer = faiss.IndexFlatIP(dim)
+    if kind == "ivf":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    if kind == "ivfpq":
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, *_pq_shape(dim, n), faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES} or 'auto'.")
+
+def index_recall(search: Callable, vectors: np.ndarray, queries: np.ndarray, k: int = 10) -> float:
+    """Mean recall@k of `search` (e.g. index.search) against exact inner-product search over `vectors`."""
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    _, found = search(queries, k)
+    hits = sum(len(np.intersect1d(t, f[f >= 0])) for t, f in zip(truth, found))
+    return hits / float(k * len(queries))
+
+def bytes_per_vector(index) -> float:
+    """Resident bytes per stored vector: its code, plus the id (IVF) or level-0 links (HNSW)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.downcast_index(index.storage).code_size + 4 * index.hnsw.nb_neighbors(0)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return ivf.code_size + 8
+    return index.code_size
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class RawVectors:
+    """
+    Append-only float32 vectors kept in a file and read through a memory map, so exact
+    copies for re-scoring cost page cache rather than process memory. New stores write
+    a temporary file (deleted with this object); a loaded store maps its saved
+    vectors.f32 read-only and switches to a temporary copy on the first append.
+    """
+    def __init__(self, dim: int, path: Optional[str] = None, count: int = 0, tmp_dir: Optional[str] = None):
+        self.dim = dim
+        self.tmp_dir = tmp_dir
+        self._count = count
+        self._map: Optional[np.ndarray] = None
+        self.path = path
+        self._readonly = path is not None  # a saved store's file; never written in place
+        if path is None:
+            self._use_temp_copy(None)
+
+    def _use_temp_copy(self, source: Optional[str]) -> None:
+        if self.tmp_dir:
+            os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=".f32", dir=self.tmp_dir)
+        os.close(fd)
+        if source:
+            shutil.copyfile(source, tmp)
+        self.path = tmp
+        self._map = None
+        weakref.finalize(self, _remove_quietly, tmp)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, vecs: np.ndarray) -> None:
+        if self._readonly:
+            self._use_temp_copy(self.path)
+            self._readonly = False
+        vecs = np.ascontiguousarray(vecs, dtype="float32").reshape(-1, self.dim)
+        with open(self.path, "ab") as f:
+            f.write(vecs.tobytes())
+        self._count += len(vecs)
+        self._map = None
+
+    def rows(self, idx) -> np.ndarray:
+        """Vectors at positions `idx` (int array or slice), copied out of the map."""
+        if self._map is None:
+            self._map = (np.memmap(self.path, dtype="float32", mode="r", shape=(self._count, self.dim))
+                         if self._count else np.zeros((0, self.dim), dtype="float32"))
+        return np.asarray(self._map[idx])
+
+    def save(self, path: str) -> None:
+        if os.path.abspath(path) != os.path.abspath(self.path):
+            shutil.copyfile(self.path, path)
+
+class CorpusTexts(Sequence):
+    """
+    Chunk texts of the whole corpus by position, backed by one ChunkArena per segment
+    (document), so each document's text is held once however much its chunks overlap.
+    """
+    def __init__(self):
+        self.arenas: List[ChunkArena] = []
+        self._starts: List[int] = []
+        self._n = 0
+
+    def append(self, arena: ChunkArena) -> None:
+        self.arenas.append(arena)
+        self._starts.append(self._n)
+        self._n += len(arena)
+
+    def drop(self, seg: int) -> None:
+        """Release a segment's text; its positions read back as empty strings."""
+        self.arenas[seg] = ChunkArena("", np.zeros((len(self.arenas[seg]), 2), dtype="int64"))
+
+    def materialize(self) -> None:
+        self.arenas = [a.materialize() for a in self.arenas]
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        seg = self.segment_of(i)
+        return self.arenas[seg][int(i) - self._starts[seg]]
+
+    def segment_of(self, i: int) -> int:
+        return bisect.bisect_right(self._starts, int(i)) - 1
+
+ProgressFn = Callable[[float], None]  # receives the completed fraction in [0, 1]
+
+def _embed_batches(texts: Sequence[str], embedder, batch_size: int, progress: Optional[ProgressFn]) -> Iterator[np.ndarray]:
+    """Embeddings of `texts` batch by batch, in order (via the embedder's iter_encode when it has one)."""
+    total = len(texts)
+    if hasattr(embedder, "iter_encode"):
+        stream = embedder.iter_encode(texts, batch_size)
+    else:
+        stream = (embedder.encode(texts[a: a + batch_size]) for a in range(0, total, batch_size))
+    done = 0
+    for emb in stream:
+        emb = emb.astype("float32")
+        yield emb
+        done += len(emb)
+        if progress:
+            progress(min(1.0, done / total))
+
+def _as_arena(texts: Sequence[str]) -> ChunkArena:
+    return texts if isinstance(texts, ChunkArena) else ChunkArena.from_chunks(list(texts))
+
+def _write_texts(path: str, texts: CorpusTexts) -> Tuple[List[List[int]], List[List[str]]]:
+    """
+    Write every segment's text to one UTF-8 buffer, plus chunk spans, pages and section
+    ids; returns per-segment byte ranges and section titles.
+    """
+    ranges, titles, spans, pages, sections = [], [], [], [], []
+    pos = 0
+    with open(os.path.join(path, "texts.bin"), "wb") as f:
+        for arena in texts.arenas:
+            raw, sp = arena.encoded()
+            f.write(raw)
+            ranges.append([pos, pos + len(raw)])
+            titles.append(arena.section_titles)
+            spans.append(sp)
+            pages.append(arena.pages)
+            sections.append(arena.sections)
+            pos += len(raw)
+    np.save(os.path.join(path, "texts_spans.npy"), np.concatenate(spans) if spans else np.zeros((0, 2), dtype="int64"))
+    np.save(os.path.join(path, "texts_pages.npy"), np.concatenate(pages) if pages else np.zeros(0, dtype="int32"))
+    np.save(os.path.join(path, "texts_sections.npy"), np.concatenate(sections) if sections else np.zeros(0, dtype="int32"))
+    return ranges, titles
+
+def _read_texts(path: str, ranges: List[List[int]], titles: List[List[str]], counts: List[int], mmap: bool) -> CorpusTexts:
+    """Reopen _write_texts() output; `counts` is the number of chunks in each segment."""
+    spans = np.load(os.path.join(path, "texts_spans.npy"))
+    pages = np.load(os.path.join(path, "texts_pages.npy"))
+    sections = np.load(os.path.join(path, "texts_sections.npy"))
+    fname = os.path.join(path, "texts.bin")
+    mmap = mmap and bool(ranges) and ranges[-1][1] > 0
+    if mmap:
+        buf = np.memmap(fname, dtype="uint8", mode="r")
+    else:
+        with open(fname, "rb") as f:
+            buf = f.read()
+    texts = CorpusTexts()
+    done = 0
+    for (a, b), seg_titles, n in zip(ranges, titles, counts):
+        part = slice(done, done + n)
+        arena = ChunkArena(buf[a:b], spans[part], pages[part], sections[part], seg_titles)
+        texts.append(arena if mmap else arena.materialize())
+        done += n
+    return texts
+
 class InMemoryVectorStore:
     """
-    Hybrid retriever with robust recall and speed:
+    Hybrid retriever over a multi-document corpus:
       1) Embedding search (over-retrieve).
-      2) TF-IDF top-M on the full corpus.
+      2) Sparse top-M: BM25 over posting lists (default) or TF-IDF cosine.
       3) Union candidates, fuse scores.
+    Documents are appended or removed without touching the rest of the corpus.
+    Removed chunks are tombstoned, so chunk positions (hit indices) do not shift;
+    their dense vectors stay in the index until compact() drops them.
+    With a compressed index type and `rescore` > 0, exact float32 copies of the vectors
+    are kept in a memory-mapped file (see RawVectors) and the top `rescore` x k dense
+    candidates are re-scored with them.
     """
-    def __init__(self, dim: int, texts: List[str]):
-        self.texts = texts
+    def __init__(
+        self, dim: int, index_type: str = "flat", n_hint: int = 0, sparse_kind: str = "bm25",
+        rescore: int = 0, raw_dir: Optional[str] = None,
+    ):
+        self.dim = dim
+        self.texts = CorpusTexts()
         self._count = 0
-        self.index = faiss.IndexFlatIP(dim)
-        self.tfidf = TfidfVectorizer(stop_words="english")
-        self.tfidf_mat = self.tfidf.fit_transform(texts)
+        self.index_type = index_type
+        self.index = _make_index(index_type, dim, n_hint)
+        self.index_info: Dict[str, float] = {"type": index_type}
+        self.sparse = make_sparse_index(sparse_kind)
+        self.docs: Dict[str, int] = {}                     # doc_id -> segment number
+        self.summaries: Dict[str, Dict[str, list]] = {}    # doc_id -> section summaries (see set_summaries)
+        self._segments: List[Tuple[str, int, int]] = []   # (doc_id, start, end), in position order
+        self._alive = np.zeros(0, dtype=bool)
+        self._index_path: Optional[str] = None             # set while the index is memory-mapped
+        self.rescore = int(rescore) if index_type in COMPRESSED_TYPES else 0
+        self.raw: Optional[RawVectors] = RawVectors(dim, tmp_dir=raw_dir) if self.rescore else None
 
     @classmethod
-    def from_texts_batched(cls, texts: List[str], embedder, batch_size: int = 64, progress: bool = False):
+    def from_texts_batched(
+        cls,
+        texts: Sequence[str],
+        embedder,
+        batch_size: int = 64,
+        progress: Optional[ProgressFn] = None,
+        index_type: str = "auto",
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        train_sample: int = 50_000,
+        recall_queries: int = 200,
+        doc_id: str = "document",
+        sparse_kind: str = "bm25",
+        rescore: int = 0,
+        raw_dir: Optional[str] = None,
+    ):
+        """
+        Embed texts in batches and build the index with them as the first document.
+        Flat indexes are filled batch by batch. Approximate ones (ivf/hnsw/ivfpq) collect
+        the embeddings first, train on a random sample of up to `train_sample` vectors and
+        record recall@10 against exact search on `recall_queries` corpus vectors.
+        `texts` may be a ChunkArena; plain chunk lists are wrapped in one.
+        """
         assert len(texts) > 0, "No texts provided to index."
-        first = texts[: min(batch_size, len(texts))]
-        emb0 = embedder.encode(first).astype("float32")
-        store = cls(emb0.shape[1], texts)
-        store.index.add(emb0); store._count += emb0.shape[0]
-
-        total, done = len(texts), len(first)
-        prog = st.progress(0) if progress else None
-        while done < total:
-            batch = texts[done: done + batch_size]
-            emb = embedder.encode(batch).astype("float32")
-            store.index.add(emb)
-            store._count += emb.shape[0]
-            done += len(batch)
-            if prog:
-                prog.progress(done / total)
-        if prog:
-            prog.progress(1.0)
+        texts = _as_arena(texts)
+        kind = choose_index_type(len(texts)) if index_type == "auto" else index_type
+        batches = _embed_batches(texts, embedder, batch_size, progress)
+        first = next(batches)
+        store = cls(first.shape[1], index_type=kind, n_hint=len(texts), sparse_kind=sparse_kind, rescore=rescore, raw_dir=raw_dir)
+        store.set_search_params(nprobe=nprobe or DEFAULT_NPROBE, ef_search=ef_search or DEFAULT_EF_SEARCH)
+        store._append(
+            doc_id, texts, itertools.chain([first], batches), store.sparse.transform(texts),
+            train_sample=train_sample, recall_queries=recall_queries if kind != "flat" else 0,
+        )
+        return store
+
+    @classmethod
+    def from_span_stream(
+        cls,
+        spans: Iterable[tuple],
+        embedder,
+        batch_size: int = 64,
+        on_batch: Optional[Callable[[int, int], None]] = None,
+        queue_size: int = 256,
+        index_type: str = "auto",
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        train_sample: int = 50_000,
+        recall_queries: int = 200,
+        doc_id: str = "document",
+        sparse_kind: str = "bm25",
+        rescore: int = 0,
+        raw_dir: Optional[str] = None,
+    ):
+        """
+        Streaming counterpart of from_texts_batched() for chunker output (spans from
+        iter_chunk_spans() / iter_structured_chunks() over extracted pages). The chunker
+        runs on a background thread and hands chunks over through a queue of `queue_size`,
+        so extraction, chunking and embedding overlap: batches are embedded while later
+        pages are still being read, and at most `queue_size` chunks wait in between.
+        A flat index is filled batch by batch; "auto" and approximate types need the final
+        chunk count, so their vectors are collected and the index is chosen/trained at the end.
+        `on_batch`, if given, receives the number of chunks embedded so far and the text
+        offset where the last of them ends.
+        """
+        builder = ArenaBuilder()
+
+        def text_batches() -> Iterator[List[str]]:
+            batch: List[str] = []
+            for span in iter_prefetched(spans, queue_size):
+                builder.add(span)
+                batch.append(span[2])
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        def embedded() -> Iterator[np.ndarray]:
+            encode = getattr(embedder, "iter_encode_batches", None)
+            stream = encode(text_batches()) if encode else (embedder.encode(b) for b in text_batches())
+            done = 0
+            for emb in stream:
+                emb = np.asarray(emb, dtype="float32")
+                yield emb
+                done += len(emb)
+                if on_batch:
+                    on_batch(done, builder.end_of(done - 1))
+
+        batches = embedded()
+        first = next(batches, None)
+        assert first is not None, "No texts provided to index."
+        if index_type == "flat":
+            store = cls(first.shape[1], index_type="flat", sparse_kind=sparse_kind)
+            store._add_vectors(itertools.chain([first], batches), 0)
+        else:
+            vecs = [first, *batches]
+            n = sum(len(v) for v in vecs)
+            kind = choose_index_type(n) if index_type == "auto" else index_type
+            store = cls(first.shape[1], index_type=kind, n_hint=n, sparse_kind=sparse_kind, rescore=rescore, raw_dir=raw_dir)
+            store._add_vectors(vecs, n, train_sample, recall_queries if kind != "flat" else 0)
+        store.set_search_params(nprobe=nprobe or DEFAULT_NPROBE, ef_search=ef_search or DEFAULT_EF_SEARCH)
+        texts = builder.build()
+        store._register(doc_id, texts, store.sparse.transform(texts), 0)
         return store
 
-    def query(self, query_text: str, embedder, k: int = 6) -> QueryHits:
-        if self._count == 0:
+    # ---------- corpus management ----------
+
+    @property
+    def documents(self) -> List[str]:
+        return list(self.docs)
+
+    @property
+    def num_chunks(self) -> int:
+        """Live (non-removed) chunks across all documents."""
+        return int(self._alive.sum())
+
+    def doc_range(self, doc_id: str) -> Tuple[int, int]:
+        _, a, b = self._segments[self.docs[doc_id]]
+        return a, b
+
+    def doc_texts(self, doc_id: str) -> ChunkArena:
+        return self.texts.arenas[self.docs[doc_id]]
+
+    def doc_text(self, doc_id: str) -> str:
+        """Full cleaned text of a document, overlaps included once (nothing is re-joined)."""
+        return self.doc_texts(doc_id).text
+
+    def doc_of(self, i: int) -> str:
+        starts = [a for _, a, _ in self._segments]
+        return self._segments[bisect.bisect_right(starts, int(i)) - 1][0]
+
+    def add_document(self, doc_id: str, texts: Sequence[str], embedder, batch_size: int = 64, progress: Optional[ProgressFn] = None) -> Tuple[int, int]:
+        """Embed and append one document (replacing any document with the same id)."""
+        assert len(texts) > 0, "No texts provided to index."
+        if doc_id in self.docs:
+            self.remove_document(doc_id)
+        texts = _as_arena(texts)
+        batches = _embed_batches(texts, embedder, batch_size, progress)
+        return self._append(doc_id, texts, batches, self.sparse.transform(texts))
+
+    def merge(self, other: "InMemoryVectorStore") -> "InMemoryVectorStore":
+        """
+        Append every document of another store, reusing its vectors and hashed term
+        counts (no re-embedding, no re-tokenizing). Returns self.
+        """
+        for doc_id, seg in other.docs.items():
+            _, a, b = other._segments[seg]
+            if doc_id in self.docs:
+                self.remove_document(doc_id)
+            self._append(doc_id, other.texts.arenas[seg].materialize(), [other._vectors(a, b)], other.sparse.block_counts(seg))
+            if doc_id in other.summaries:
+                self.summaries[doc_id] = other.summaries[doc_id]
+        return self
+
+    def remove_document(self, doc_id: str) -> None:
+        if doc_id not in self.docs:
+            raise KeyError(f"Unknown document: {doc_id!r}")
+        self._ensure_writable()
+        seg = self.docs.pop(doc_id)
+        self.summaries.pop(doc_id, None)
+        _, a, b = self._segments[seg]
+        self._alive[a:b] = False
+        self.texts.drop(seg)
+        self.sparse.remove_block(seg)
+
+    def compact(self, min_dead: float = 0.25) -> bool:
+        """
+        Drop the vectors of removed chunks once they make up at least `min_dead` of all
+        positions (every search over-fetches by count / live). Live documents are
+        re-appended to an emptied copy of the trained index, reusing their vectors and
+        term counts; chunk positions are renumbered. Returns whether it compacted.
+        """
+        if not self._count or 1.0 - self.num_chunks / self._count < min_dead:
+            return False
+        self._ensure_writable()
+        fresh = InMemoryVectorStore(
+            self.dim, self.index_type, sparse_kind=self.sparse.kind, rescore=self.rescore,
+            raw_dir=self.raw.tmp_dir if self.raw is not None else None,
+        )
+        fresh.index = faiss.clone_index(self.index)  # keeps training and search parameters
+        fresh.index.reset()
+        fresh.index_info = dict(self.index_info)
+        fresh.merge(self)
+        self.__dict__.update(fresh.__dict__)
+        return True
+
+    def _append(
+        self,
+        doc_id: str,
+        texts: ChunkArena,
+        batches: Iterable[np.ndarray],
+        counts: sparse.csr_matrix,
+        train_sample: int = 50_000,
+        recall_queries: int = 0,
+    ) -> Tuple[int, int]:
+        self._ensure_writable()
+        start = self._count
+        self._add_vectors(batches, len(texts), train_sample, recall_queries)
+        return self._register(doc_id, texts, counts, start)
+
+    def _add_vectors(self, batches: Iterable[np.ndarray], n: int, train_sample: int = 50_000, recall_queries: int = 0) -> None:
+        """Add `n` vectors arriving in batches; untrained indexes collect them and train first."""
+        if not self.index.is_trained or recall_queries:
+            vecs = np.empty((n, self.dim), dtype="float32")
+            done = 0
+            for emb in batches:
+                vecs[done: done + len(emb)] = emb
+                done += len(emb)
+            if self.raw is not None:
+                self.raw.append(vecs)
+            self._train_and_add(vecs, train_sample, recall_queries)
+        else:
+            for emb in batches:
+                if self.raw is not None:
+                    self.raw.append(emb)
+                self.index.add(emb)
+                self._count += emb.shape[0]
+        self.index_info["bytes_per_chunk"] = float(bytes_per_vector(self.index))
+        if self.raw is not None:
+            self.index_info["raw_bytes_per_chunk"] = 4.0 * self.dim  # on disk, memory-mapped
+
+    def _register(self, doc_id: str, texts: ChunkArena, counts: sparse.csr_matrix, start: int) -> Tuple[int, int]:
+        """Record a document whose vectors now occupy positions [start, _count)."""
+        self.texts.append(texts)
+        self.docs[doc_id] = self.sparse.add_block(counts)
+        self._segments.append((doc_id, start, self._count))
+        self._alive = np.concatenate([self._alive, np.ones(self._count - start, dtype=bool)])
+        return start, self._count
+
+    def _vectors(self, a: int, b: int) -> np.ndarray:
+        """Stored vectors for positions [a, b): exact raw copies if kept, else decoded from the index."""
+        if self.raw is not None:
+            return self.raw.rows(slice(a, b))
+        if self.index_type in ("ivf", "ivfpq"):
+            ivf = faiss.extract_index_ivf(self.index)
+            if not ivf.direct_map.type:
+                ivf.make_direct_map()
+        return self.index.reconstruct_n(a, b - a)
+
+    def live_vectors(self) -> np.ndarray:
+        """Stored vectors of all live chunks, in position order."""
+        return self._vectors(0, self._count)[self._alive] if self._count else np.zeros((0, self.dim), dtype="float32")
+
+    def _ensure_writable(self) -> None:
+        # Memory-mapped FAISS codes are read-only; load them for real before the first
+        # mutation. Mapped text arenas can stay mapped: segments are only appended or dropped.
+        if self._index_path is not None:
+            self.index = faiss.read_index(self._index_path)
+            self._index_path = None
+
+    def _train_and_add(self, vecs: np.ndarray, train_sample: int, recall_queries: int) -> None:
+        rng = np.random.default_rng(0)
+        if not self.index.is_trained:
+            sample = vecs
+            if len(vecs) > train_sample:
+                sample = vecs[np.sort(rng.choice(len(vecs), train_sample, replace=False))]
+            self.index.train(sample)
+        self.index.add(vecs)
+        self._count += vecs.shape[0]
+        if recall_queries:
+            q = vecs[rng.choice(len(vecs), min(recall_queries, len(vecs)), replace=False)]
+            self.index_info["recall@10"] = index_recall(self.index.search, vecs, q, k=10)
+            if self.raw is not None:
+                self.index_info["recall@10_rescored"] = index_recall(self._dense_search, vecs, q, k=10)
+
+    def _dense_search(self, q_emb: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        index.search(); with raw vectors kept, `rescore` x k candidates are fetched from
+        the compressed index and re-ranked by their exact inner products.
+        """
+        if self.raw is None:
+            return self.index.search(q_emb, k)
+        _, cand = self.index.search(q_emb, min(self._count, k * self.rescore))
+        ok = cand >= 0
+        vecs = self.raw.rows(np.where(ok, cand, 0).ravel()).reshape(*cand.shape, self.dim)
+        exact = np.where(ok, np.einsum("qcd,qd->qc", vecs, q_emb), -np.inf).astype("float32")
+        order = np.argsort(-exact, axis=1, kind="stable")[:, :k]
+        scores = np.take_along_axis(exact, order, axis=1)
+        ids = np.where(np.isfinite(scores), np.take_along_axis(cand, order, axis=1), -1)
+        return scores, ids
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+        """Search-time knobs: IVF lists probed per query, HNSW candidate list size."""
+        if self.index_type in ("ivf", "ivfpq") and nprobe:
+            ivf = faiss.extract_index_ivf(self.index)
+            ivf.nprobe = int(min(nprobe, ivf.nlist))
+            self.index_info["nprobe"] = ivf.nprobe
+        if self.index_type == "hnsw" and ef_search:
+            self.index.hnsw.efSearch = int(ef_search)
+            self.index_info["ef_search"] = int(ef_search)
+
+    # ---------- chunk metadata ----------
+
+    def chunk_meta(self, i: int) -> Dict[str, object]:
+        """Document, page, section and character offsets (within the document text) of chunk i."""
+        seg = self.texts.segment_of(i)
+        meta = self.texts.arenas[seg].meta(int(i) - self._segments[seg][1])
+        meta["doc"] = self._segments[seg][0]
+        return meta
+
+    def sections(self, doc_id: Optional[str] = None) -> List[str]:
+        """Section titles of one document, or of the whole corpus (first-seen order)."""
+        segs = [self.docs[doc_id]] if doc_id is not None else list(self.docs.values())
+        return list(dict.fromkeys(t for s in segs for t in self.texts.arenas[s].section_titles))
+
+    def set_summaries(self, doc_id: str, ranges: List[Tuple[int, int]], summaries: List[str]) -> None:
+        """
+        Attach precomputed section summaries to a document: `ranges` are [start, end)
+        chunk ranges local to the document, one summary each.
+        """
+        assert len(ranges) == len(summaries)
+        self.summaries[doc_id] = {"ranges": [[int(a), int(b)] for a, b in ranges], "summaries": list(summaries)}
+
+    def save_summaries(self, path: str) -> None:
+        """Update only the section summaries of a store previously written by save()."""
+        fname = os.path.join(path, "meta.json")
+        with open(fname, encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["summaries"] = {d: v for d, v in self.summaries.items() if d in meta["docs"]}
+        # Replace meta.json in one step: other sessions may be loading this store right now.
+        fd, tmp = tempfile.mkstemp(prefix=".meta.", suffix=".json", dir=path)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp, fname)
+        except BaseException:
+            _remove_quietly(tmp)
+            raise
+
+    def _candidates(self, sections: Optional[Sequence[str]], doc_id: Optional[str] = None) -> np.ndarray:
+        alive = self._alive
+        if sections:
+            alive = alive & np.concatenate([a.section_mask(sections) for a in self.texts.arenas])
+        if doc_id is not None:
+            a, b = self.doc_range(doc_id)
+            in_doc = np.zeros_like(alive)
+            in_doc[a:b] = True
+            alive = alive & in_doc
+        return alive
+
+    # ---------- retrieval ----------
+
+    def query(
+        self, query_text: str, embedder, k: int = 6, sections: Optional[Sequence[str]] = None,
+        q_emb: Optional[np.ndarray] = None, doc_id: Optional[str] = None,
+    ) -> QueryHits:
+        """
+        Hybrid top-k; `sections` restricts hits to chunks under matching section titles,
+        `doc_id` to the chunks of one document.
+        Pass `q_emb` (shape (1, dim)) to reuse an already computed query embedding.
+        """
+        alive = self._candidates(sections, doc_id)
+        n_alive = int(alive.sum())
+        if n_alive == 0:
             return QueryHits(indices=[], scores=[])
 
-        # 1) Embedding search
-        q_emb = embedder.encode([query_text]).astype("float32")
-        over_k = min(max(k * 6, k), self._count)
-        emb_scores, emb_idx = self.index.search(q_emb, over_k)
+        # 1) Embedding search (widened to make up for tombstoned chunks)
+        if q_emb is None:
+            q_emb = embedder.encode([query_text])
+        q_emb = np.asarray(q_emb, dtype="float32").reshape(1, -1)
+        M = min(max(k * 6, k), n_alive)
+        over_k = min(self._count, int(np.ceil(M * self._count / n_alive)))
+        emb_scores, emb_idx = self._dense_search(q_emb, over_k)
         emb_scores = emb_scores[0]; emb_idx = emb_idx[0]
+        keep = emb_idx >= 0  # approximate indexes may return fewer than over_k hits
+        keep[keep] = alive[emb_idx[keep]]
+        emb_scores = emb_scores[keep]; emb_idx = emb_idx[keep]
 
-        # 2) TF-IDF top-M across full corpus
-        q_vec = self.tfidf.transform([query_text])
-        kw_scores_all = cosine_similarity(q_vec, self.tfidf_mat)[0]
-        M = min(max(k * 6, k), self._count)
-        kw_idx_sorted = np.argsort(-kw_scores_all)[:M]
+        # 2) Sparse top-M across full corpus (removed chunks always score 0)
+        kw_scores_all = self.sparse.scores(query_text)
+        if alive is not self._alive:
+            kw_scores_all = np.where(alive, kw_scores_all, 0.0)
+        kw_idx_sorted = top_positive(kw_scores_all, M)
 
         # 3) Union candidates + fusion
         union_idx = np.unique(np.concatenate([emb_idx, kw_idx_sorted]))
@@ -79,6 +675,176 @@ class InMemoryVectorStore:
         fused = 0.70 * emb_n + 0.30 * kw_n
 
         order = np.argsort(-fused)[:k]
-        final_idx = union_idx[order]
+        final_idx = union_idx[order].tolist()
         final_scores = fused[order].tolist()
-        return QueryHits(indices=final_idx.tolist(), scores=final_scores)
+        return QueryHits(indices=final_idx, scores=final_scores, doc_ids=[self.doc_of(i) for i in final_idx])
+
+    def query_batch(
+        self, queries: List[str], embedder, k: int = 6, slab_cells: int = 1 << 22,
+        sections: Optional[Sequence[str]] = None, doc_id: Optional[str] = None,
+    ) -> List[QueryHits]:
+        """
+        Vectorized query() for many questions: one embedder call, one FAISS search over
+        the query matrix, one sparse matrix product for keyword scores, and fusion done
+        on (queries x candidates) arrays. Queries are processed in slabs so the dense
+        keyword scores never exceed `slab_cells` floats.
+        Ranking matches query() (ties aside).
+        """
+        alive = self._candidates(sections, doc_id)
+        n_alive = int(alive.sum())
+        if n_alive == 0 or not queries:
+            return [QueryHits(indices=[], scores=[]) for _ in queries]
+
+        # 1) Embedding search for all queries at once
+        q_emb = embedder.encode(list(queries)).astype("float32")
+        M = min(max(k * 6, k), n_alive)
+        over_k = min(self._count, int(np.ceil(M * self._count / n_alive)))
+        emb_scores, emb_idx = self._dense_search(q_emb, over_k)
+        emb_ok = emb_idx >= 0
+        emb_ok[emb_ok] = alive[emb_idx[emb_ok]]
+
+        # 2) Sparse scores for all queries as one matrix product
+        kw_all = self.sparse.scores_batch(list(queries))
+
+        out: List[QueryHits] = []
+        slab = max(1, slab_cells // max(1, self._count))
+        for s0 in range(0, len(queries), slab):
+            rows = slice(s0, s0 + slab)
+            kw = kw_all[rows].toarray()
+            if alive is not self._alive:
+                kw[:, ~alive] = 0.0
+            kw_idx = np.argpartition(-kw, M - 1, axis=1)[:, :M]
+            kw_top = np.take_along_axis(kw, kw_idx, axis=1)
+            e_idx, e_sc, e_ok = emb_idx[rows], emb_scores[rows], emb_ok[rows]
+
+            # 3) Union candidates (dense hits first, keyword-only hits after) + fusion
+            kw_ok = (kw_top > 0) & ~((kw_idx[:, :, None] == np.where(e_ok, e_idx, -1)[:, None, :]).any(-1))
+            cand = np.concatenate([e_idx, kw_idx], axis=1)
+            ok = np.concatenate([e_ok, kw_ok], axis=1)
+            emb_c = np.concatenate([e_sc, np.zeros_like(kw_top)], axis=1)
+            kw_c = np.take_along_axis(kw, np.where(ok, cand, 0), axis=1)
+
+            fused = 0.70 * _normalize_rows(emb_c, ok) + 0.30 * _normalize_rows(kw_c, ok)
+            fused = np.where(ok, fused, -np.inf)
+            order = np.argsort(-fused, axis=1, kind="stable")[:, :k]
+            top_idx = np.take_along_axis(cand, order, axis=1)
+            top_sc = np.take_along_axis(fused, order, axis=1)
+            for idx_row, sc_row in zip(top_idx, top_sc):
+                keep = np.isfinite(sc_row)
+                idx_list = idx_row[keep].tolist()
+                out.append(QueryHits(indices=idx_list, scores=sc_row[keep].tolist(),
+                                     doc_ids=[self.doc_of(i) for i in idx_list]))
+        return out
+
+    # ---------- persistence ----------
+
+    def save(self, path: str) -> None:
+        """
+        Write the whole store to a directory:
+          dense.faiss            FAISS index
+          sparse_*/bm25_*.npy    sparse retriever arrays (term counts or posting lists)
+          alive.npy              tombstone mask per chunk position
+          vectors.f32            raw float32 vectors for re-scoring (compressed indexes only)
+          texts.bin/texts_*.npy  document texts as one UTF-8 buffer + chunk byte spans,
+                                 pages and section ids
+          meta.json              documents, section summaries and bookkeeping
+        The files are written to a temporary sibling directory that then replaces `path`, so
+        readers (other sessions sharing an index cache) never see a partial store, and
+        files they have memory-mapped are never rewritten in place.
+        """
+        path = os.path.abspath(path)
+        parent, base = os.path.split(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f".{base}.tmp-", dir=parent)
+        old = f"{tmp}.old"
+        try:
+            self._write(tmp)
+            if os.path.exists(path):
+                os.replace(path, old)  # open memory maps keep the old files alive
+            try:
+                os.replace(tmp, path)
+            except OSError:
+                if not os.path.exists(os.path.join(path, "meta.json")):
+                    raise
+                # Another writer put a complete store there first; keep theirs.
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+            shutil.rmtree(old, ignore_errors=True)
+
+    def _write(self, path: str) -> None:
+        faiss.write_index(self.index, os.path.join(path, "dense.faiss"))
+        sparse_meta = self.sparse.save(path)
+        np.save(os.path.join(path, "alive.npy"), self._alive)
+        if self.raw is not None:
+            self.raw.save(os.path.join(path, "vectors.f32"))
+        text_ranges, text_sections = _write_texts(path, self.texts)
+        meta = {
+            "version": STORE_FORMAT_VERSION,
+            "dim": int(self.dim),
+            "count": int(self._count),
+            "index_type": self.index_type,
+            "index_info": self.index_info,
+            "rescore": self.rescore,
+            "segments": [[d, int(a), int(b)] for d, a, b in self._segments],
+            "docs": self.docs,
+            "text_ranges": text_ranges,
+            "text_sections": text_sections,
+            "summaries": self.summaries,
+            "sparse": sparse_meta,
+        }
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "InMemoryVectorStore":
+        """
+        Open a store written by save(). With mmap=True the FAISS vectors, the sparse
+        arrays and the texts are memory-mapped and paged in by the OS on demand;
+        they are copied into memory only if the corpus is later modified.
+        """
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported store format version: {meta.get('version')}")
+
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) if mmap else 0
+        index_path = os.path.join(path, "dense.faiss")
+        store = cls.__new__(cls)
+        store.dim = int(meta["dim"])
+        store.index = faiss.read_index(index_path, flags)
+        store._index_path = index_path if mmap else None
+        store._count = int(meta["count"])
+        store.index_type = meta["index_type"]
+        store.index_info = meta["index_info"]
+        store.rescore = int(meta.get("rescore", 0))
+        store.raw = RawVectors(store.dim, os.path.join(path, "vectors.f32"), store._count) if store.rescore else None
+        store._alive = np.load(os.path.join(path, "alive.npy"))
+        store._segments = [(d, int(a), int(b)) for d, a, b in meta["segments"]]
+        store.texts = _read_texts(path, meta["text_ranges"], meta["text_sections"], [b - a for _, a, b in store._segments], mmap)
+        store.docs = {d: int(i) for d, i in meta["docs"].items()}
+        store.summaries = meta.get("summaries", {})
+        sparse_meta = meta["sparse"]
+        store.sparse = SPARSE_INDEXES[sparse_meta["kind"]].load(
+            path, sparse_meta, [(a, b) for _, a, b in store._segments], mmap
+        )
+        return store
+
+def storage_report(
+    vectors: np.ndarray,
+    kinds: Sequence[str] = ("flat", "fp16", "sq8", "pq", "ivfpq"),
+    rescore: int = 4,
+    recall_queries: int = 200,
+) -> List[Dict[str, float]]:
+    """
+    Index `vectors` with each dense storage option and return its index_info:
+    bytes_per_chunk, recall@10 against exact search on `recall_queries` of the
+    vectors, and (compressed types) recall@10_rescored with raw-vector re-scoring.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    rows = []
+    for kind in kinds:
+        store = InMemoryVectorStore(vectors.shape[1], index_type=kind, n_hint=len(vectors), rescore=rescore)
+        store.set_search_params(nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH)
+        store._add_vectors([vectors], len(vectors), recall_queries=recall_queries)
+        rows.append(dict(store.index_info))
+    return rows
@@ -1,38 +1,294 @@
+import bisect
+import math
+import queue
 import re
-import streamlit as st
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Tuple, TypeVar, Union
 
-def chunk_text_streaming(
-    text: str,
+def _normalize(text: str) -> str:
+    # Collapse spaces but keep newlines; consolidate multiple newlines.
+    text = re.sub(r"[ \t]+", " ", text)
+    return re.sub(r"\n{2,}", "\n", text).strip()
+
+def iter_chunk_spans(
+    text: Union[str, Iterable[str]],
     max_chars: int,
     overlap: int,
-    max_total_chars: int = 400_000,
-    progress: bool = False
-):
+    max_total_chars: Optional[int] = None,
+    progress: Optional[Callable[[float], None]] = None
+) -> Iterator[Tuple[int, int, str]]:
     """
-    Streaming chunker: yields chunks with overlap and enforces a hard cap on total chars.
+    Streaming chunker: yields (start, end, chunk) with overlap, optionally stopping once
+    `max_total_chars` have been chunked (None = no cap). Offsets index the cleaned text.
     IMPORTANT: preserve newlines so headers/sections survive.
+    `text` may also be an iterable of pieces (e.g. PDF pages), joined with newlines;
+    full chunks are emitted as soon as enough text has arrived, and the source is not
+    consumed past the cap.
+    `progress`, if given, is called with the completed fraction after each chunk
+    (for piece streams the total is unknown, so it is reported once at the end).
     """
     if not text:
         return
-    # Collapse spaces but keep newlines; consolidate multiple newlines.
-    text = re.sub(r"[ \t]+", " ", text)
-    text = re.sub(r"\n{2,}", "\n", text).strip()
+    if max_total_chars is None:
+        max_total_chars = math.inf
+    n_known = None
+    if isinstance(text, str):
+        text = _normalize(text)
+        n_known = len(text)
+    pieces = [text] if n_known is not None else text
+    steps = max(1, n_known // max(1, max_chars - overlap)) if n_known is not None else 1
 
-    n = len(text)
+    buf = ""      # unconsumed text, starting at absolute offset `base`
+    base = 0
     produced = 0
-    i = 0
-    prog = st.progress(0) if progress else None
-    steps = max(1, n // max(1, max_chars - overlap))
-
+    i = 0         # absolute start of the next chunk
     step = 0
-    while i < n and produced < max_total_chars:
-        j = min(i + max_chars, n)
-        chunk = text[i:j]
+
+    def emit_ready(n: int, final: bool):
+        nonlocal buf, base, produced, i, step
+        while i < n and produced < max_total_chars:
+            if not final and i + max_chars >= n:
+                break
+            j = min(i + max_chars, n)
+            chunk = buf[i - base: j - base]
+            yield i, j, chunk
+            produced += len(chunk)
+            if final and j == n:
+                i = n  # the tail is covered; don't re-emit its overlap
+                break
+            i = j - overlap
+            if i <= 0:
+                i = j
+            step += 1
+            if progress and n_known is not None:
+                progress(min(1.0, step / steps))
+        if progress and n_known is not None and i >= n:
+            progress(1.0)
+        if overlap < max_chars and i > base:
+            # Starts only move forward, so text before `i` is never read again.
+            buf, base = buf[i - base:], i
+
+    for piece in pieces:
+        if n_known is None:
+            piece = _normalize(piece)
+        if not piece:
+            continue
+        buf = f"{buf}\n{piece}" if (buf or base) else piece
+        yield from emit_ready(base + len(buf), final=False)
+        if produced >= max_total_chars:
+            break
+    yield from emit_ready(base + len(buf), final=True)
+    if progress and n_known is None:
+        progress(1.0)
+
+def chunk_text_streaming(
+    text: Union[str, Iterable[str]],
+    max_chars: int,
+    overlap: int,
+    max_total_chars: Optional[int] = None,
+    progress: Optional[Callable[[float], None]] = None
+) -> Iterator[str]:
+    """iter_chunk_spans() without the offsets."""
+    for _, _, chunk in iter_chunk_spans(text, max_chars, overlap, max_total_chars, progress):
         yield chunk
-        produced += len(chunk)
-        i = j - overlap
-        if i <= 0:
-            i = j
-        step += 1
-        if prog:
-            prog.progress(min(1.0, step / steps))
+
+# ---------- structure-aware chunking ----------
+
+_NUMBERED_HEADING = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.|[A-Z]\.)\s+\S")
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]?\s")
+
+def heading_title(line: str) -> Optional[str]:
+    """Return the title if a line looks like a heading (markdown, numbered, ALL CAPS, Title Case)."""
+    s = line.strip()
+    if s.startswith("#"):
+        s = s.lstrip("#").strip()
+        return s or None
+    if not 3 <= len(s) <= 80 or s[-1] in ".,;!?" or not any(c.isalpha() for c in s):
+        return None
+    words = s.rstrip(":").split()
+    if len(words) > 10:
+        return None
+    if _NUMBERED_HEADING.match(s):
+        return s.rstrip(":")
+    letters = [c for c in s if c.isalpha()]
+    if all(c.isupper() for c in letters) and len(letters) >= 3:
+        return s.rstrip(":")
+    capped = sum(1 for w in words if w[0].isupper() or not w[0].isalpha())
+    if len(words) >= 2 and capped / len(words) >= 0.7 and not s.endswith(":"):
+        return s
+    return None
+
+def iter_structured_chunks(
+    pages: Union[str, Iterable[str]],
+    max_chars: int,
+    overlap: int,
+    max_total_chars: Optional[int] = None,
+    progress: Optional[Callable[[float], None]] = None,
+    max_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+    paginated: bool = True,
+) -> Iterator[Tuple[int, int, str, int, str]]:
+    """
+    Structure-aware variant of iter_chunk_spans(): yields (start, end, chunk, page, section).
+    Pages (pieces of the stream, numbered from 1) are joined with newlines as before, but
+    each chunk ends at the best boundary inside its window, in order of preference:
+    page break, heading, paragraph (newline), sentence end, space, hard cut. Chunks that end
+    at a page break or heading carry no overlap into the next one; otherwise the next chunk
+    starts `overlap` chars back, moved forward to a word start. `section` is the last heading
+    at or before the chunk start ("" if none); `page` is the page holding the chunk start,
+    or 0 (unknown) when the input is not a page stream (`paginated=False`, e.g. TXT/DOCX).
+    With `max_tokens` and `count_tokens`, `max_chars` is only a ceiling: a chunk over the
+    token budget is re-cut in a proportionally smaller window until it fits.
+    """
+    if not pages:
+        return
+    if max_total_chars is None:
+        max_total_chars = math.inf
+    n_known = None
+    if isinstance(pages, str):
+        pages = _normalize(pages)
+        n_known = len(pages)
+    pieces = [pages] if n_known is not None else pages
+    steps = max(1, n_known // max(1, max_chars - overlap)) if n_known is not None else 1
+
+    buf = ""                  # unconsumed text, starting at absolute offset `base`
+    base = 0
+    produced = 0
+    i = 0                     # absolute start of the next chunk
+    step = 0
+    page_starts = []          # (abs start, page number), ascending
+    headings = []             # (abs line start, title), ascending
+
+    def last_before(marks, pos, default):
+        k = bisect.bisect_right(marks, pos, key=lambda m: m[0])
+        return marks[k - 1][1] if k else default
+
+    def cut(n: int, final: bool, limit: int) -> Tuple[int, bool]:
+        """End of the chunk starting at i, and whether it ends on a structural boundary."""
+        hi = min(i + limit, n)
+        min_struct = max(1, limit // 4)   # earliest page/heading cut inside a window
+        min_text = max(1, limit // 2)     # earliest paragraph/sentence/space cut
+        for marks in (page_starts, headings):
+            best = [p for p, _ in marks if i + min_struct <= p < hi or p == hi < n]
+            if best:
+                return best[-1], True
+        if final and hi == n:
+            return n, True
+        window = buf[i - base: hi - base]
+        nl = window.rfind("\n", min_text)
+        if nl >= 0:
+            return i + nl + 1, False
+        ends = [m.end() for m in _SENTENCE_END.finditer(window, min_text)]
+        if ends:
+            return i + ends[-1], False
+        sp = window.rfind(" ", min_text)
+        if sp >= 0:
+            return i + sp + 1, False
+        return hi, False
+
+    def emit_ready(n: int, final: bool):
+        nonlocal buf, base, produced, i, step, page_starts, headings
+        while i < n and produced < max_total_chars:
+            if not final and i + max_chars >= n:
+                break
+            j, structural = cut(n, final, max_chars)
+            if max_tokens and count_tokens:
+                while j - i > 1:
+                    tokens = count_tokens(buf[i - base: j - base])
+                    if tokens <= max_tokens:
+                        break
+                    limit = max(1, min(j - i - 1, int((j - i) * max_tokens / tokens * 0.95)))
+                    j, structural = cut(n, final, limit)
+            chunk = buf[i - base: j - base]
+            yield i, j, chunk, last_before(page_starts, i, 1) if paginated else 0, last_before(headings, i, "")
+            produced += len(chunk)
+            step += 1
+            if progress and n_known is not None:
+                progress(min(1.0, step / steps))
+            if j >= n and final:
+                i = n
+                break
+            nxt = j
+            if not structural and overlap > 0:
+                nxt = max(i + 1, j - overlap)
+                if buf[nxt - base - 1] not in " \n":  # mid-word: move to the next word start
+                    sp = buf.find(" ", nxt - base, j - base)
+                    nxt = base + sp + 1 if sp >= 0 else j
+            i = nxt
+        # Drop text and marks that no later chunk can reach (keeping the current page/section).
+        if i > base:
+            buf, base = buf[i - base:], i
+        page_starts = page_starts[max(0, bisect.bisect_right(page_starts, i, key=lambda m: m[0]) - 1):]
+        headings = headings[max(0, bisect.bisect_right(headings, i, key=lambda m: m[0]) - 1):]
+
+    for page_no, piece in enumerate(pieces, 1):
+        if n_known is None:
+            piece = _normalize(piece)
+        if not piece:
+            continue
+        start = base + len(buf) + (1 if (buf or base) else 0)
+        buf = f"{buf}\n{piece}" if (buf or base) else piece
+        page_starts.append((start, page_no))
+        pos = start
+        for line in piece.split("\n"):
+            title = heading_title(line)
+            if title:
+                headings.append((pos, title))
+            pos += len(line) + 1
+        yield from emit_ready(base + len(buf), final=False)
+        if produced >= max_total_chars:
+            break
+    yield from emit_ready(base + len(buf), final=True)
+    if progress:
+        progress(1.0)
+
+# ---------- pipelining ----------
+
+T = TypeVar("T")
+
+def iter_prefetched(items: Iterable[T], maxsize: int = 256) -> Iterator[T]:
+    """
+    Iterate `items` on a background thread, handing them over through a bounded queue:
+    the producer (e.g. extraction + chunking) runs at most `maxsize` items ahead of the
+    consumer (e.g. embedding) and blocks when it is that far ahead. Exceptions are
+    re-raised in the consumer; closing the iterator early stops the producer.
+    """
+    q: "queue.Queue[tuple]" = queue.Queue(maxsize=max(1, int(maxsize)))
+    stop = threading.Event()
+
+    def put(kind: str, value) -> bool:
+        while not stop.is_set():
+            try:
+                q.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run() -> None:
+        it = iter(items)
+        try:
+            for item in it:
+                if not put("item", item):
+                    return
+            put("done", None)
+        except BaseException as e:
+            put("error", e)
+        finally:
+            close = getattr(it, "close", None)
+            if close:
+                close()  # e.g. lets iter_pdf_pages shut its pool down
+
+    worker = threading.Thread(target=run, name="prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            kind, value = q.get()
+            if kind == "item":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+    finally:
+        stop.set()